@@ -305,7 +305,7 @@ def mqtt_publish(mqtt_config: dict, payload: dict):
         client.connect(host, port, 10)
         client.publish(
             topic,
-            json.dumps(payload),
+            json.dumps(payload, separators=(",", ":"), ensure_ascii=False),
             qos=1,
             retain=False,
         )
@@ -26,6 +26,16 @@ class TestRescanHelpers(unittest.TestCase):
         self.assertIsNone(parse_source_type("unknown"))
         self.assertIsNone(parse_source_type(""))
 
+    def test_is_temp_mkv(self):
+        is_temp_mkv = self.rescan.is_temp_mkv
+        self.assertTrue(is_temp_mkv(Path("B1_t00.mkv")))
+        self.assertTrue(is_temp_mkv(Path("/raw/ab_T12.MKV")))
+        self.assertFalse(is_temp_mkv(Path("Show-S01E01.mkv")))
+        self.assertFalse(is_temp_mkv(Path("B1_t0a.mkv")))
+        self.assertFalse(is_temp_mkv(Path("B1-t00.mkv")))
+        self.assertFalse(is_temp_mkv(Path("B1_t00.mp4")))
+        self.assertFalse(is_temp_mkv(Path("É1_t00.mkv")))
+
     def test_find_source_type_marker(self):
         find_source_type_marker = self.rescan.find_source_type_marker
         parse_source_type = self.rescan.parse_source_type
@@ -38,6 +48,24 @@ class TestRescanHelpers(unittest.TestCase):
             result = find_source_type_marker(leaf, base)
             self.assertEqual(result, parse_source_type("bluray"))
 
+    def test_find_source_type_marker_uses_cache(self):
+        find_source_type_marker = self.rescan.find_source_type_marker
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base = Path(tmpdir).resolve()
+            first = base / "a" / "b"
+            second = base / "a" / "c"
+            first.mkdir(parents=True)
+            second.mkdir(parents=True)
+            (base / ".source_type").write_text("dvd")
+            cache = {}
+            self.assertEqual(find_source_type_marker(first, base, cache), "dvd")
+            self.assertEqual(cache[base / "a"], "dvd")
+
+            (base / ".source_type").unlink()
+            # Cached ancestor answers without touching the filesystem again.
+            self.assertEqual(find_source_type_marker(second, base, cache), "dvd")
+            self.assertIsNone(find_source_type_marker(second, base))
+
     def test_classify_height(self):
         classify_height = self.rescan.classify_height
         self.assertEqual(classify_height(576), "dvd")
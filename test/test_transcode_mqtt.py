@@ -1,4 +1,6 @@
 import importlib.util
+import io
+import json
 import os
 import tempfile
 import unittest
@@ -16,6 +18,13 @@ def load_transcode_module():
     return module
 
 
+def ffprobe_json(*streams, duration=None) -> bytes:
+    data = {"streams": list(streams)}
+    if duration is not None:
+        data["format"] = {"duration": str(duration)}
+    return json.dumps(data).encode()
+
+
 class TestTranscodeHelpers(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -36,13 +45,17 @@ class TestTranscodeHelpers(unittest.TestCase):
     def test_detect_interlaced(self):
         detect_interlaced = self.transcode.detect_interlaced
         with mock.patch.object(self.transcode.subprocess, "check_output") as mocked:
-            mocked.return_value = b"tt\n"
+            mocked.return_value = ffprobe_json(
+                {"codec_type": "video", "field_order": "tt"}
+            )
             with mock.patch.object(self.transcode, "run_idet") as run_idet:
                 self.assertTrue(detect_interlaced(Path("dummy.mkv")))
                 run_idet.assert_not_called()
 
         with mock.patch.object(self.transcode.subprocess, "check_output") as mocked:
-            mocked.return_value = b"progressive\n"
+            mocked.return_value = ffprobe_json(
+                {"codec_type": "video", "field_order": "progressive"}
+            )
             with mock.patch.object(self.transcode, "run_idet") as run_idet:
                 run_idet.return_value = (5, 3, 1, 0)
                 self.assertTrue(detect_interlaced(Path("dummy.mkv")))
@@ -52,7 +65,9 @@ class TestTranscodeHelpers(unittest.TestCase):
                 self.assertFalse(detect_interlaced(Path("dummy.mkv")))
 
         with mock.patch.object(self.transcode.subprocess, "check_output") as mocked:
-            mocked.return_value = b"unknown\n"
+            mocked.return_value = ffprobe_json(
+                {"codec_type": "video", "field_order": "unknown"}
+            )
             with mock.patch.object(self.transcode, "run_idet") as run_idet:
                 run_idet.return_value = None
                 self.assertTrue(detect_interlaced(Path("dummy.mkv")))
@@ -63,11 +78,74 @@ class TestTranscodeHelpers(unittest.TestCase):
                 run_idet.return_value = None
                 self.assertTrue(detect_interlaced(Path("dummy.mkv")))
 
+    def test_parse_idet_batch_maps_filters_to_inputs(self):
+        transcode = self.transcode
+        paths = [Path("a.mkv"), Path("b.mkv"), Path("c.mkv")]
+        output = "\n".join(
+            [
+                "[Parsed_idet_0 @ 0x1] Single frame detection: TFF: 1 BFF: 0 "
+                "Progressive: 90 Undetermined: 9",
+                "[Parsed_idet_0 @ 0x1] Multi frame detection: TFF: 0 BFF: 0 "
+                "Progressive: 99 Undetermined: 1",
+                "[Parsed_idet_1 @ 0x2] Multi frame detection: TFF: 80 BFF: 0 "
+                "Progressive: 10 Undetermined: 10",
+            ]
+        )
+        self.assertEqual(
+            transcode.parse_idet_batch(output, 3),
+            [(0, 0, 99, 1), (80, 0, 10, 10), None],
+        )
+
+        # Two sampled windows for a.mkv, one window from the start for b.mkv.
+        windows = {paths[0]: [(600.0, 50), (1500.0, 50)], paths[1]: [(None, 100)]}
+        proc = mock.MagicMock(stderr=io.StringIO(output + "\nframe= 100\n"))
+        proc.__enter__.return_value = proc
+        proc.wait.return_value = 0
+        with (
+            mock.patch.object(transcode, "idet_windows", lambda p, _f: windows[p]),
+            mock.patch.object(transcode.subprocess, "Popen", return_value=proc) as run,
+        ):
+            self.assertEqual(
+                transcode.run_idet_batch(paths[:2], 100),
+                {paths[0]: (80, 0, 109, 11)},
+            )
+        cmd = run.call_args.args[0]
+        self.assertEqual(
+            cmd[cmd.index("-ss") : cmd.index("-ss") + 4],
+            ["-ss", "600.000", "-i", "a.mkv"],
+        )
+        self.assertEqual(cmd.count("-i"), 3)
+        self.assertEqual(cmd.count("-threads"), 3)
+        self.assertEqual(cmd[cmd.index("-threads") + 1], "1")
+
+        with mock.patch.object(transcode, "probe_media") as probe_media:
+            probe_media.return_value = {"duration": 1000.0}
+            self.assertEqual(
+                transcode.idet_windows(paths[0], 500),
+                [(200.0, 167), (500.0, 167), (800.0, 167)],
+            )
+            probe_media.return_value = {"duration": 30.0}
+            self.assertEqual(transcode.idet_windows(paths[0], 500), [(None, 500)])
+
+        with mock.patch.object(self.transcode, "run_idet") as run_idet:
+            with mock.patch.object(self.transcode, "probe_media") as probe_media:
+                probe_media.return_value = {"field_order": "progressive"}
+                self.assertTrue(
+                    transcode.detect_interlaced(paths[1], idet_counts=(80, 0, 10, 10))
+                )
+            run_idet.assert_not_called()
+
     def test_probe_audio_streams(self):
         probe_audio_streams = self.transcode.probe_audio_streams
         with mock.patch.object(self.transcode.subprocess, "check_output") as mocked:
-            mocked.return_value = (
-                b'{"streams":[{"index":1,"channels":6,"tags":{"language":"eng"}}]}'
+            mocked.return_value = ffprobe_json(
+                {"index": 0, "codec_type": "video", "codec_name": "h264"},
+                {
+                    "index": 1,
+                    "codec_type": "audio",
+                    "channels": 6,
+                    "tags": {"language": "eng"},
+                },
             )
             self.assertEqual(
                 probe_audio_streams(Path("dummy.mkv")),
@@ -78,6 +156,30 @@ class TestTranscodeHelpers(unittest.TestCase):
             mocked.side_effect = OSError("boom")
             self.assertEqual(probe_audio_streams(Path("dummy.mkv")), [])
 
+    def test_probe_media_runs_ffprobe_once_per_unchanged_file(self):
+        transcode = self.transcode
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mkv = Path(tmpdir) / "title.mkv"
+            mkv.write_bytes(b"fake")
+            with mock.patch.object(transcode.subprocess, "check_output") as mocked:
+                mocked.return_value = ffprobe_json(
+                    {"index": 0, "codec_type": "video", "codec_name": "mpeg2video"},
+                    {"index": 3, "codec_type": "subtitle", "tags": {"language": "ger"}},
+                    duration=42.0,
+                )
+                media = transcode.probe_media(mkv)
+                self.assertEqual(transcode.probe_video_codec(mkv), "mpeg2video")
+                self.assertEqual(
+                    transcode.probe_subtitle_streams(mkv),
+                    [{"index": 3, "language": "ger"}],
+                )
+                self.assertEqual(media["duration"], 42.0)
+                self.assertEqual(mocked.call_count, 1)
+
+                mkv.write_bytes(b"changed")
+                transcode.probe_media(mkv)
+                self.assertEqual(mocked.call_count, 2)
+
     def test_build_audio_args(self):
         build_audio_args = self.transcode.build_audio_args
         self.assertIn("256k", build_audio_args(0, 2, "dvd"))
@@ -144,13 +246,157 @@ class TestTranscodeHelpers(unittest.TestCase):
     def test_probe_video_codec(self):
         probe_video_codec = self.transcode.probe_video_codec
         with mock.patch.object(self.transcode.subprocess, "check_output") as mocked:
-            mocked.return_value = b"vc1\n"
+            mocked.return_value = ffprobe_json(
+                {"index": 0, "codec_type": "video", "codec_name": "VC1"}
+            )
             self.assertEqual(probe_video_codec(Path("dummy.mkv")), "vc1")
 
         with mock.patch.object(self.transcode.subprocess, "check_output") as mocked:
             mocked.side_effect = OSError("boom")
             self.assertIsNone(probe_video_codec(Path("dummy.mkv")))
 
+    def test_mqtt_publish_encodes_json(self):
+        transcode = self.transcode
+        client = mock.Mock()
+        payload = {"version": 3, "file": "/media/Serien/Söhne.mkv", "ts": 1}
+        transcode.mqtt_publish(client, "media/transcode/done", payload)
+        client.publish.assert_called_once()
+        topic, raw = client.publish.call_args.args
+        self.assertEqual(topic, "media/transcode/done")
+        self.assertEqual(json.loads(raw), payload)
+        self.assertEqual(client.publish.call_args.kwargs["qos"], 1)
+
+        raw = json.dumps(payload).encode()
+        self.assertEqual(transcode.decode_payload(raw), payload)
+
+        with mock.patch.object(transcode, "orjson", None):
+            encoded = transcode.encode_payload(payload)
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(json.loads(encoded), payload)
+            self.assertEqual(transcode.decode_payload(raw), payload)
+
+    def test_done_reporter_batches_per_job(self):
+        transcode = self.transcode
+        client = mock.Mock()
+        with transcode.DoneReporter(client, batched=True) as reporter:
+            reporter.done(Path("/media/Serien/a.mkv"))
+            reporter.done(Path("/media/Serien/b.mkv"))
+            client.publish.assert_not_called()
+        client.publish.assert_called_once()
+        payload = json.loads(client.publish.call_args.args[1])
+        self.assertEqual(
+            payload["files"], ["/media/Serien/a.mkv", "/media/Serien/b.mkv"]
+        )
+
+        client = mock.Mock()
+        with transcode.DoneReporter(client, batched=False) as reporter:
+            reporter.done(Path("/media/Serien/a.mkv"))
+            client.publish.assert_called_once()
+        payload = json.loads(client.publish.call_args.args[1])
+        self.assertEqual(payload["file"], "/media/Serien/a.mkv")
+        self.assertEqual(
+            client.publish.call_args.kwargs["qos"], transcode.MQTT_STATUS_QOS
+        )
+
+    def test_on_connect_subscribes_on_every_connect(self):
+        transcode = self.transcode
+        client = transcode.build_mqtt_client()
+        self.assertEqual(client._client_id.decode(), transcode.MQTT_CLIENT_ID)
+        self.assertFalse(client._clean_session)
+
+        client = mock.Mock()
+        flags = mock.Mock(session_present=False)
+        transcode.on_connect(client, None, flags, 0)
+        client.subscribe.assert_called_once_with(transcode.MQTT_TOPIC, qos=1)
+
+        client = mock.Mock()
+        flags = mock.Mock(session_present=True)
+        transcode.on_connect(client, None, flags, 0)
+        client.subscribe.assert_called_once_with(transcode.MQTT_TOPIC, qos=1)
+
+        client = mock.Mock()
+        transcode.on_connect(client, None, {"session present": 0}, 5)
+        client.subscribe.assert_not_called()
+
+    def test_hw_input_args_default_to_vaapi_bridge(self):
+        transcode = self.transcode
+        self.assertFalse(transcode.QSV_DIRECT)
+        self.assertEqual(
+            transcode.QSV_INPUT_ARGS[:2],
+            ("-init_hw_device", "vaapi=va:/dev/dri/renderD128"),
+        )
+        self.assertEqual(transcode.VAAPI_INPUT_ARGS[-2:], ("-filter_hw_device", "va"))
+
+    def test_on_message_enqueues_without_touching_the_filesystem(self):
+        transcode = self.transcode
+        payload = {
+            "version": transcode.MQTT_PAYLOAD_VERSION,
+            "path": "/does/not/exist/disc01",
+            "mode": "series",
+            "source_type": "dvd",
+        }
+        msg = mock.Mock(payload=json.dumps(payload).encode())
+        job_queue = mock.Mock()
+        with mock.patch.object(transcode.Path, "exists") as exists:
+            transcode.on_message(None, job_queue, msg)
+            exists.assert_not_called()
+        job = job_queue.put.call_args.args[0]
+        self.assertEqual(job["path"], "/does/not/exist/disc01")
+        self.assertEqual(job["files"], [])
+
+    def test_run_ffmpeg_logs_stderr_only_on_failure(self):
+        transcode = self.transcode
+        subprocess = transcode.subprocess
+
+        def fake_popen(returncode, stderr=b""):
+            def popen(cmd, **kwargs):
+                kwargs["stderr"].write(stderr)
+                proc = mock.MagicMock()
+                proc.__enter__.return_value = proc
+                proc.stdout = io.StringIO(
+                    "out_time_us=1800000000\nfps=50.0\nspeed=2.0x\nprogress=end\n"
+                )
+                proc.wait.return_value = returncode
+                return proc
+
+            return mock.patch.object(subprocess, "Popen", side_effect=popen)
+
+        with fake_popen(0) as popen:
+            with self.assertLogs(level="INFO") as logs:
+                transcode.run_ffmpeg(["ffmpeg", "-i", "in.mkv", "out.mkv"], 3600.0)
+        kwargs = popen.call_args.kwargs
+        self.assertIs(kwargs["stdin"], subprocess.DEVNULL)
+        self.assertIs(kwargs["stdout"], subprocess.PIPE)
+        self.assertFalse(kwargs["close_fds"])
+        self.assertIn("00:30:00 (50%), fps=50.0, speed=2.0x", logs.output[-1])
+
+        with (
+            mock.patch.object(transcode, "TRANSCODE_CPUS", "0-3"),
+            mock.patch.object(transcode, "TASKSET_BIN", "/usr/bin/taskset"),
+            fake_popen(0) as popen,
+        ):
+            transcode.run_ffmpeg(["ffmpeg", "-i", "in.mkv", "out.mkv"])
+        self.assertEqual(
+            popen.call_args.args[0][:4], ["/usr/bin/taskset", "-c", "0-3", "ffmpeg"]
+        )
+
+        with fake_popen(1, b"boom\n"):
+            with self.assertLogs(level="WARNING") as logs:
+                with self.assertRaises(subprocess.CalledProcessError):
+                    transcode.run_ffmpeg(["ffmpeg"])
+        self.assertIn("boom", logs.output[-1])
+
+    def test_ffmpeg_watchdog_kills_stalled_encode(self):
+        transcode = self.transcode
+        read_fd, write_fd = os.pipe()
+        proc = mock.MagicMock()
+        proc.kill.side_effect = lambda: os.close(write_fd)
+        os.write(write_fd, b"out_time_us=1000000\nprogress=continue\n")
+        with open(read_fd) as stdout:
+            with transcode.FfmpegWatchdog(proc, 0.2) as watchdog:
+                transcode.log_ffmpeg_progress(stdout, None, watchdog)
+        proc.kill.assert_called_once()
+
     def test_audio_mode_default_copy(self):
         self.assertEqual(self.transcode.AUDIO_MODE, "auto")
 
@@ -165,6 +411,368 @@ class TestTranscodeHelpers(unittest.TestCase):
             finally:
                 del os.environ["FFMPEG_BIN"]
 
+    def test_find_executable_returns_absolute_path(self):
+        transcode = self.transcode
+        with mock.patch.object(
+            transcode.shutil, "which", return_value="/usr/bin/ffprobe"
+        ):
+            self.assertEqual(transcode.find_executable("ffprobe"), "/usr/bin/ffprobe")
+        with mock.patch.object(transcode.shutil, "which", return_value=None):
+            self.assertEqual(transcode.find_executable("ffprobe"), "ffprobe")
+
+    def test_gpu_lock_is_idempotent_and_keeps_file_open(self):
+        transcode = self.transcode
+        fcntl = transcode.fcntl
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lock_path = Path(tmpdir) / "vaapi.lock"
+            with mock.patch.object(fcntl, "flock") as flock:
+                with transcode.GpuLock(lock_path) as gpu_lock:
+                    gpu_lock.acquire()
+                    gpu_lock.acquire()
+                    fh = gpu_lock.fh
+                    self.assertFalse(os.get_inheritable(fh.fileno()))
+                    gpu_lock.release()
+                    gpu_lock.release()
+                    self.assertFalse(gpu_lock.held)
+                    gpu_lock.acquire()
+                    self.assertIs(gpu_lock.fh, fh)
+                self.assertIsNone(gpu_lock.fh)
+                self.assertTrue(fh.closed)
+            self.assertEqual(
+                [c.args[1] for c in flock.call_args_list],
+                [
+                    fcntl.LOCK_EX | fcntl.LOCK_NB,
+                    fcntl.LOCK_UN,
+                    fcntl.LOCK_EX | fcntl.LOCK_NB,
+                    fcntl.LOCK_UN,
+                ],
+            )
+
+    def test_gpu_lock_waits_when_contended(self):
+        transcode = self.transcode
+        fcntl = transcode.fcntl
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lock_path = Path(tmpdir) / "vaapi.lock"
+            with transcode.GpuLock(lock_path) as other:
+                other.acquire()
+                with mock.patch.object(fcntl, "flock", wraps=fcntl.flock) as flock:
+                    flock.side_effect = [BlockingIOError(), None, None]
+                    with transcode.GpuLock(lock_path) as gpu_lock:
+                        gpu_lock.acquire()
+                        self.assertTrue(gpu_lock.held)
+                self.assertEqual(flock.call_args_list[1].args[1], fcntl.LOCK_EX)
+
+    def test_gpu_lock_takes_a_free_slot(self):
+        transcode = self.transcode
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lock_path = Path(tmpdir) / "vaapi.lock"
+            with (
+                transcode.GpuLock(lock_path, 2) as first,
+                transcode.GpuLock(lock_path, 2) as second,
+                transcode.GpuLock(lock_path, 2) as third,
+            ):
+                first.acquire()
+                second.acquire()
+                self.assertEqual(Path(first.fh.name), lock_path)
+                self.assertEqual(Path(second.fh.name), Path(f"{lock_path}.1"))
+                self.assertFalse(third._try_acquire())
+                second.release()
+                with mock.patch.object(transcode.time, "sleep") as sleep:
+                    third.acquire()
+                sleep.assert_not_called()
+                self.assertEqual(Path(third.fh.name), Path(f"{lock_path}.1"))
+
+    @unittest.skipUnless(hasattr(os, "posix_fadvise"), "needs posix_fadvise")
+    def test_drop_page_cache(self):
+        transcode = self.transcode
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mkv = Path(tmpdir) / "title.mkv"
+            mkv.write_bytes(b"fake")
+            with mock.patch.object(transcode.os, "posix_fadvise") as fadvise:
+                transcode.drop_page_cache(str(mkv))
+                transcode.drop_page_cache(str(Path(tmpdir) / "missing.mkv"))
+            fadvise.assert_called_once()
+            self.assertEqual(fadvise.call_args.args[1:], (0, 0, os.POSIX_FADV_DONTNEED))
+
+    def test_iter_mkv_entries(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base = Path(tmpdir)
+            nested = base / "S01" / "disc01"
+            nested.mkdir(parents=True)
+            (nested / "Show-S01E01.mkv").write_text("")
+            (nested / "Show-S01E01.nfo").write_text("")
+            (base / "Show-S01E00.mkv").write_text("")
+            (base / "link").symlink_to(nested, target_is_directory=True)
+
+            found = sorted(
+                Path(entry.path) for entry in self.transcode.iter_mkv_entries(base)
+            )
+            self.assertEqual(found, sorted(base.rglob("*.mkv")))
+
+    def test_probe_source_skips_detection_for_known_interlacing(self):
+        transcode = self.transcode
+        with (
+            mock.patch.object(transcode, "detect_interlaced") as detect,
+            mock.patch.object(transcode, "probe_media") as probe_media,
+        ):
+            probe_media.return_value = {
+                "video_codec": "h264",
+                "field_order": "",
+                "audio_streams": [],
+                "subtitle_streams": [],
+                "duration": 12.5,
+            }
+            detect.return_value = True
+            self.assertEqual(
+                transcode.probe_source(Path("a.mkv"), False),
+                (False, "h264", [], [], 12.5),
+            )
+            detect.assert_not_called()
+            self.assertTrue(transcode.probe_source(Path("a.mkv"), None)[0])
+            # The decision is remembered with the probe result.
+            self.assertTrue(probe_media.return_value["interlaced"])
+            detect.reset_mock()
+            self.assertTrue(transcode.probe_source(Path("a.mkv"), None)[0])
+            detect.assert_not_called()
+
+    def test_probe_source_does_not_persist_failed_probe(self):
+        transcode = self.transcode
+        subprocess = transcode.subprocess
+        store = mock.MagicMock()
+        store.get_probe.return_value = None
+        with tempfile.TemporaryDirectory() as tmpdir:
+            mkv = Path(tmpdir) / "title.mkv"
+            mkv.write_bytes(b"fake")
+            with (
+                mock.patch.object(transcode, "PROBE_STORE", store),
+                mock.patch.object(transcode, "detect_interlaced", return_value=True),
+                mock.patch.object(subprocess, "check_output") as check_output,
+            ):
+                check_output.side_effect = subprocess.CalledProcessError(1, ["ffprobe"])
+                with self.assertLogs(level="WARNING"):
+                    self.assertEqual(
+                        transcode.probe_source(mkv, None), (True, None, [], [], None)
+                    )
+                store.put_probe.assert_not_called()
+
+                check_output.side_effect = None
+                check_output.return_value = ffprobe_json(
+                    {"index": 0, "codec_type": "video", "codec_name": "h264"},
+                    {"index": 1, "codec_type": "audio", "channels": 2},
+                )
+                interlaced, codec, audio, _subs, _duration = transcode.probe_source(
+                    mkv, None
+                )
+        self.assertEqual(check_output.call_count, 2)
+        self.assertTrue(interlaced)
+        self.assertEqual(codec, "h264")
+        self.assertEqual(audio, [{"index": 1, "channels": 2, "language": None}])
+
+    def test_probe_duration_falls_back_to_full_probe(self):
+        transcode = self.transcode
+        subprocess = transcode.subprocess
+        with mock.patch.object(subprocess, "check_output") as check_output:
+            check_output.return_value = b"1234.5\n"
+            self.assertEqual(transcode.probe_duration(Path("out.mkv")), 1234.5)
+            self.assertIn("-find_stream_info", check_output.call_args.args[0])
+
+            check_output.reset_mock()
+            check_output.side_effect = [
+                subprocess.CalledProcessError(1, ["ffprobe"]),
+                b"1234.5\n",
+            ]
+            self.assertEqual(transcode.probe_duration(Path("out.mkv")), 1234.5)
+            self.assertNotIn("-find_stream_info", check_output.call_args.args[0])
+
+            check_output.side_effect = [b"N/A\n", b"N/A\n"]
+            with self.assertLogs(level="WARNING"):
+                self.assertIsNone(transcode.probe_duration(Path("out.mkv")))
+
+    def test_gpu_local_cpus(self):
+        gpu_local_cpus = self.transcode.gpu_local_cpus
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sys_root = Path(tmpdir)
+            device_dir = sys_root / "class" / "drm" / "renderD128" / "device"
+            node_dir = sys_root / "devices" / "system" / "node" / "node1"
+            device_dir.mkdir(parents=True)
+            node_dir.mkdir(parents=True)
+            (node_dir / "cpulist").write_text("16-31\n")
+            self.assertEqual(gpu_local_cpus("/dev/dri/renderD128", sys_root), "")
+            (device_dir / "numa_node").write_text("-1\n")
+            self.assertEqual(gpu_local_cpus("/dev/dri/renderD128", sys_root), "")
+            (device_dir / "numa_node").write_text("1\n")
+            self.assertEqual(gpu_local_cpus("/dev/dri/renderD128", sys_root), "16-31")
+
+    def test_hw_device_available(self):
+        transcode = self.transcode
+        subprocess = transcode.subprocess
+        with mock.patch.object(subprocess, "run") as run:
+            self.assertTrue(transcode.hw_device_available())
+            self.assertIn(f"vaapi=va:{transcode.HW_DEVICE}", run.call_args.args[0])
+            run.side_effect = subprocess.CalledProcessError(1, ["ffmpeg"])
+            with self.assertLogs(level="WARNING"):
+                self.assertFalse(transcode.hw_device_available())
+
+    def test_parse_vainfo_low_power(self):
+        parse = self.transcode.parse_vainfo_low_power
+        output = (
+            "vainfo: Supported profile and entrypoints\n"
+            "      VAProfileHEVCMain               :\tVAEntrypointEncSliceLP\n"
+            "      VAProfileHEVCMain10             :\tVAEntrypointVLD\n"
+            "      VAProfileHEVCMain10             :\tVAEntrypointEncSlice\n"
+        )
+        self.assertTrue(parse(output, "VAProfileHEVCMain"))
+        self.assertFalse(parse(output, "VAProfileHEVCMain10"))
+        self.assertTrue(
+            parse(
+                output
+                + "      VAProfileHEVCMain10             :\tVAEntrypointEncSliceLP\n",
+                "VAProfileHEVCMain10",
+            )
+        )
+
+    def test_partial_output_path(self):
+        self.assertEqual(
+            self.transcode.partial_output_path(Path("/media/Serien/Show/E01.mkv")),
+            Path("/media/Serien/Show/.E01.partial.mkv"),
+        )
+
+    def test_transcode_dir_removes_partial_of_failed_encode(self):
+        transcode = self.transcode
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            mkv = tmp / "raw" / "Film.mkv"
+            mkv.parent.mkdir()
+            mkv.write_bytes(b"fake")
+            dst = tmp / "movies"
+
+            def failing_encode(cmd, _duration):
+                Path(cmd[-1]).write_bytes(b"half")
+                raise transcode.CalledProcessError(1, cmd)
+
+            with (
+                mock.patch.object(transcode, "MOVIE_DST_BASE", dst),
+                mock.patch.object(transcode, "VAAPI_LOCK_PATH", tmp / "vaapi.lock"),
+                mock.patch.object(transcode, "ENABLE_SW_FALLBACK", True),
+                mock.patch.object(transcode, "hw_device_available", return_value=False),
+                mock.patch.object(
+                    transcode, "vaapi_low_power_supported", return_value=False
+                ),
+                mock.patch.object(
+                    transcode,
+                    "probe_source",
+                    return_value=(False, "h264", [], [], None),
+                ),
+                mock.patch.object(transcode, "run_ffmpeg", side_effect=failing_encode),
+                mock.patch.object(transcode, "mqtt_publish") as publish,
+            ):
+                with self.assertRaises(transcode.CalledProcessError):
+                    transcode.transcode_dir(
+                        mock.Mock(), {"files": [str(mkv)], "mode": "movie"}
+                    )
+            self.assertEqual(list(dst.iterdir()), [])
+            self.assertEqual(
+                publish.call_args_list[-1].args[1], transcode.MQTT_TOPIC_ERROR
+            )
+
+    def test_lock_partial_output_is_exclusive(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            part = Path(tmpdir) / ".E01.partial.mkv"
+            part.write_bytes(b"leftover")
+            fd = self.transcode.lock_partial_output(part)
+            self.assertIsNotNone(fd)
+            try:
+                self.assertIsNone(self.transcode.lock_partial_output(part))
+                self.assertEqual(part.read_bytes(), b"leftover")
+            finally:
+                os.close(fd)
+            fd = self.transcode.lock_partial_output(part)
+            self.assertIsNotNone(fd)
+            os.close(fd)
+
+    def test_resolve_job_files_resolves_each_directory_once(self):
+        transcode = self.transcode
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base = Path(tmpdir).resolve()
+            (base / "disc").mkdir()
+            (base / "link").symlink_to(base / "disc")
+            raw = [
+                f"{base}/link/A.mkv",
+                f"{base}/link/B.mkv",
+                f"{base}/disc/C.mkv",
+                f"{base}/disc/A.mkv",
+            ]
+            with mock.patch.object(
+                transcode.Path, "resolve", autospec=True, side_effect=Path.resolve
+            ) as resolve:
+                files = transcode.resolve_job_files(raw)
+        self.assertEqual(
+            files,
+            [base / "disc" / "A.mkv", base / "disc" / "B.mkv", base / "disc" / "C.mkv"],
+        )
+        self.assertEqual(resolve.call_count, 2)
+
+    def test_skip_existing_outputs_lists_shared_parents_once(self):
+        transcode = self.transcode
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base = Path(tmpdir)
+            season = base / "Show" / "S01"
+            season.mkdir(parents=True)
+            (season / "E01.mkv").write_bytes(b"done")
+            (base / "Movie.mkv").write_bytes(b"done")
+            plans = [
+                (Path("/raw/E01.mkv"), season / "E01.mkv"),
+                (Path("/raw/E02.mkv"), season / "E02.mkv"),
+                (Path("/raw/Movie.mkv"), base / "Movie.mkv"),
+                (Path("/raw/New.mkv"), base / "New" / "New.mkv"),
+                (Path("/raw/S02E01.mkv"), base / "Show" / "S02" / "E01.mkv"),
+                (Path("/raw/S02E02.mkv"), base / "Show" / "S02" / "E02.mkv"),
+            ]
+            with mock.patch.object(
+                transcode.os, "scandir", wraps=transcode.os.scandir
+            ) as scandir:
+                pending = list(transcode.skip_existing_outputs(plans))
+        self.assertEqual(
+            [out.name for _mkv, out in pending],
+            ["E02.mkv", "New.mkv", "E01.mkv", "E02.mkv"],
+        )
+        self.assertEqual(scandir.call_count, 2)
+
+    def test_plan_outputs(self):
+        transcode = self.transcode
+        series_base = Path("/raw/dvd/Serien")
+        job_root = Path("/raw/dvd/Filme/Movie")
+        with (
+            mock.patch.object(transcode, "SERIES_DST_BASE", Path("/media/Serien")),
+            mock.patch.object(transcode, "MOVIE_DST_BASE", Path("/media/Filme")),
+        ):
+            self.assertEqual(
+                transcode.plan_outputs(
+                    [job_root / "Movie.mkv"], "movie", job_root, series_base
+                ),
+                [(job_root / "Movie.mkv", Path("/media/Filme/Movie.mkv"))],
+            )
+            episode = series_base / "Show" / "S01" / "disc01" / "Show-S01E01.mkv"
+            stray = Path("/elsewhere/Show-S01E02.mkv")
+            self.assertEqual(
+                transcode.plan_outputs(
+                    [episode, stray], "series", episode.parent, series_base
+                ),
+                [
+                    (
+                        episode,
+                        Path("/media/Serien/Show/S01/disc01/Show-S01E01.mkv"),
+                    )
+                ],
+            )
+            # A sibling directory sharing the name prefix is not under the base.
+            sibling_root = Path("/raw/dvd/Serien-Extra/Show")
+            extra = sibling_root / "S01" / "Extra.mkv"
+            self.assertEqual(
+                transcode.plan_outputs([extra], "series", sibling_root, series_base),
+                [(extra, Path("/media/Serien/S01/Extra.mkv"))],
+            )
+
     def test_series_src_base_for_source(self):
         transcode = self.transcode
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -16,18 +16,17 @@ import argparse
 import json
 import logging
 import os
-import re
 import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
 
 import paho.mqtt.client as mqtt  # type: ignore
 
 MQTT_PAYLOAD_VERSION = 3
-TEMP_MKV_RE = re.compile(r"^[A-Za-z0-9]{2}_[A-Za-z][0-9]{2}\.mkv$", re.IGNORECASE)
 
 
 # --------------------
@@ -44,8 +43,19 @@ def getenv_bool(name, default="false"):
     return os.getenv(name, default).strip().lower() in {"1", "true", "yes", "on"}
 
 
-def is_temp_mkv(path: Path) -> bool:
-    return bool(TEMP_MKV_RE.match(path.name))
+def is_temp_mkv(path: Path | os.DirEntry) -> bool:
+    # MakeMKV temp names like "B1_t00.mkv" ([A-Za-z0-9]{2}_[A-Za-z][0-9]{2}.mkv),
+    # checked by slicing: this runs for every entry of the directory walk.
+    name = path.name
+    return (
+        len(name) == 10
+        and name.isascii()
+        and name[:2].isalnum()
+        and name[2] == "_"
+        and name[3].isalpha()
+        and name[4:6].isdigit()
+        and name[6:].lower() == ".mkv"
+    )
 
 
 def parse_source_type(value: str) -> str | None:
@@ -68,23 +78,39 @@ def collect_source_roots(src_base: Path, default_type: str) -> List[Tuple[str, P
     return [(default_type, src_base)]
 
 
-def find_source_type_marker(start_dir: Path, stop_dir: Path) -> str | None:
+def find_source_type_marker(
+    start_dir: Path,
+    stop_dir: Path,
+    cache: Dict[Path, str | None] | None = None,
+) -> str | None:
     """
     Walks up from start_dir to stop_dir (inclusive) and checks for .source_type.
+    With a cache dict, every visited directory remembers the result, so sibling
+    directories below the same root stop at the first already-known ancestor.
     """
     current = start_dir
     stop_dir = stop_dir.resolve()
+    visited: List[Path] = []
+    result: str | None = None
     while True:
+        if cache is not None and current in cache:
+            result = cache[current]
+            break
+        visited.append(current)
         marker = current / ".source_type"
         if marker.is_file():
             try:
-                return parse_source_type(marker.read_text().strip())
+                result = parse_source_type(marker.read_text().strip())
+                break
             except OSError as e:
                 logging.warning("failed to read %s: %s", marker, e)
         if current == stop_dir or current.parent == current:
             break
         current = current.parent
-    return None
+    if cache is not None:
+        for path in visited:
+            cache[path] = result
+    return result
 
 
 def classify_height(height: int) -> str | None:
@@ -111,9 +137,9 @@ def probe_height(path: Path) -> int | None:
                 str(path),
             ],
             stderr=subprocess.DEVNULL,
+            text=True,
         )
-        height_raw = out.decode().strip()
-        return int(height_raw)
+        return int(out.strip())
     except Exception as e:
         logging.warning("ffprobe height failed for %s: %s", path, e)
         return None
@@ -125,8 +151,9 @@ def detect_source_type(
     fallback: str,
     sample: Path,
     sample_height: int | None = None,
+    marker_cache: Dict[Path, str | None] | None = None,
 ) -> str:
-    marker = find_source_type_marker(start_dir, stop_dir)
+    marker = find_source_type_marker(start_dir, stop_dir, marker_cache)
     if marker:
         return marker
     height = sample_height
@@ -160,10 +187,12 @@ def filter_ready_mkvs(
     return ready, dropped, sample_height
 
 
-def chunk_list(items: List[Path], size: int) -> List[List[Path]]:
+def chunk_iter(items: List[Path], size: int) -> Iterator[List[Path]]:
     if size <= 0:
-        return [items]
-    return [items[i : i + size] for i in range(0, len(items), size)]
+        yield items
+        return
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
 
 
 def build_mqtt_client() -> mqtt.Client:
@@ -193,7 +222,7 @@ def connect_mqtt(client: mqtt.Client):
 
 
 def mqtt_publish(client: mqtt.Client | None, topic: str, payload: dict, dry_run: bool):
-    msg = json.dumps(payload)
+    msg = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
     if dry_run:
         logging.info("[dry-run] would publish to %s: %s", topic, msg)
         return
@@ -236,14 +265,105 @@ def load_env_file(path: Path):
             os.environ[key] = value.strip()
 
 
-def is_recent_enough(path: Path, cutoff_ts: float | None) -> bool:
+def iter_mkv_dirs(root: Path) -> Iterator[Tuple[str, int | None, List[os.DirEntry]]]:
+    """
+    Liefert pro Verzeichnis unterhalb von root (dir, mtime_ns, [*.mkv-Einträge])
+    – wie rglob, ohne Symlinks auf Verzeichnisse zu folgen. Die mtime wird vor
+    dem Listing gelesen. Path-Objekte entstehen erst beim Aufrufer und nur für
+    Dateien, die er wirklich braucht.
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        current = stack.pop()
+        mkvs: List[os.DirEntry] = []
+        try:
+            mtime_ns = os.stat(current).st_mtime_ns
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".mkv"):
+                        mkvs.append(entry)
+        except (FileNotFoundError, PermissionError) as e:
+            logging.warning("cannot scan %s: %s", current, e)
+            continue
+        if mkvs:
+            yield current, mtime_ns, mkvs
+
+
+def dir_mtime_ns(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ScanState:
+    """
+    Merkt sich pro Quell-Verzeichnis die mtimes von Quelle und Ziel aus dem
+    letzten Lauf, in dem dort nichts fehlte. Solange sich beide nicht ändern
+    (keine Datei dazu/weg), wird das Verzeichnis nicht erneut Datei für Datei
+    geprüft.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.previous: Dict[str, list] = {}
+        self.current: Dict[str, list] = {}
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            logging.info("scan state not found, starting fresh: %s", self.path)
+            return
+        except (OSError, ValueError) as e:
+            logging.warning("ignoring unreadable scan state %s: %s", self.path, e)
+            return
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            logging.warning("ignoring scan state with unknown format: %s", self.path)
+            return
+        dirs = data.get("dirs")
+        if isinstance(dirs, dict):
+            self.previous = dirs
+
+    def is_unchanged(self, key: str, fingerprint: list) -> bool:
+        if self.previous.get(key) == fingerprint:
+            self.current[key] = fingerprint
+            return True
+        return False
+
+    def mark_complete(self, key: str, fingerprint: list):
+        self.current[key] = fingerprint
+
+    def save(self):
+        payload = json.dumps({"version": self.VERSION, "dirs": self.current})
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(payload)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.warning("could not write scan state %s: %s", self.path, e)
+            return
+        logging.info(
+            "scan state saved to %s (%d complete dirs)", self.path, len(self.current)
+        )
+
+
+def is_recent_enough(path: Path | os.DirEntry, cutoff_ts: float | None) -> bool:
     if cutoff_ts is None:
         return True
     return path.stat().st_mtime >= cutoff_ts
 
 
 def collect_missing_series_dirs(
-    src_base: Path, dst_base: Path, cutoff_ts: float | None = None
+    src_base: Path,
+    dst_base: Path,
+    cutoff_ts: float | None = None,
+    scan_state: ScanState | None = None,
 ) -> Tuple[Dict[Path, List[Path]], List[Path]]:
     """
     Liefert {directory: [missing mkv files]} und eine Liste übersprungener Temp-MKVs.
@@ -255,23 +375,49 @@ def collect_missing_series_dirs(
         logging.warning("series source base does not exist: %s", src_base)
         return missing, skipped
 
-    for mkv in src_base.rglob("*.mkv"):
-        if is_temp_mkv(mkv):
-            logging.info("skip temp mkv from scan: %s", mkv)
-            skipped.append(mkv)
-            continue
-        if not is_recent_enough(mkv, cutoff_ts):
-            continue
-        rel = mkv.relative_to(src_base)
-        dest = dst_base / rel
-        if not dest.exists():
-            missing.setdefault(mkv.parent, []).append(mkv)
-
+    log_each_temp = logging.getLogger().isEnabledFor(logging.DEBUG)
+    # Scan-Pfade haben src_base als Präfix; String-Slicing spart pro
+    # Datei ein relative_to() samt Path-Objekt für das Ziel.
+    src_prefix_len = len(os.path.join(src_base, ""))
+    dst_prefix = os.path.join(dst_base, "")
+    for dir_path, src_mtime, entries in iter_mkv_dirs(src_base):
+        fingerprint = None
+        if scan_state is not None:
+            fingerprint = [
+                src_mtime,
+                dir_mtime_ns(dst_prefix + dir_path[src_prefix_len:]),
+            ]
+            if scan_state.is_unchanged("series:" + dir_path, fingerprint):
+                continue
+        src_dir = Path(dir_path)
+        complete = True
+        for entry in entries:
+            if is_temp_mkv(entry):
+                if log_each_temp:
+                    logging.debug("skip temp mkv from scan: %s", entry.path)
+                skipped.append(src_dir / entry.name)
+                complete = False
+                continue
+            if not is_recent_enough(entry, cutoff_ts):
+                complete = False
+                continue
+            rel = entry.path[src_prefix_len:]
+            if not os.path.exists(dst_prefix + rel):
+                missing.setdefault(src_dir, []).append(src_dir / entry.name)
+                complete = False
+        if complete and fingerprint is not None:
+            scan_state.mark_complete("series:" + dir_path, fingerprint)
+
+    if skipped:
+        logging.info("skipped %d temp mkv files under %s", len(skipped), src_base)
     return missing, skipped
 
 
 def collect_missing_movie_dirs(
-    movie_src_base: Path, movie_dst_base: Path, cutoff_ts: float | None = None
+    movie_src_base: Path,
+    movie_dst_base: Path,
+    cutoff_ts: float | None = None,
+    scan_state: ScanState | None = None,
 ) -> Tuple[Dict[Path, List[Path]], List[Path]]:
     """
     Liefert {directory: [mkv files]} für Movie-MKVs, deren Ziel fehlt,
@@ -284,35 +430,150 @@ def collect_missing_movie_dirs(
         logging.info("movie source base does not exist, skipping: %s", movie_src_base)
         return missing, skipped
 
-    for mkv in movie_src_base.rglob("*.mkv"):
-        if is_temp_mkv(mkv):
-            logging.info("skip temp mkv from scan: %s", mkv)
-            skipped.append(mkv)
-            continue
-        if not is_recent_enough(mkv, cutoff_ts):
-            continue
+    log_each_temp = logging.getLogger().isEnabledFor(logging.DEBUG)
+    src_prefix_len = len(os.path.join(movie_src_base, ""))
+    dst_prefix = os.path.join(movie_dst_base, "")
+    dst_base_mtime = dir_mtime_ns(dst_prefix) if scan_state is not None else None
+    for dir_path, src_mtime, entries in iter_mkv_dirs(movie_src_base):
+        fingerprint = None
+        if scan_state is not None:
+            fingerprint = [
+                src_mtime,
+                dst_base_mtime,
+                dir_mtime_ns(dst_prefix + dir_path[src_prefix_len:]),
+            ]
+            if scan_state.is_unchanged("movie:" + dir_path, fingerprint):
+                continue
+        src_dir = Path(dir_path)
+        complete = True
+        for entry in entries:
+            if is_temp_mkv(entry):
+                if log_each_temp:
+                    logging.debug("skip temp mkv from scan: %s", entry.path)
+                skipped.append(src_dir / entry.name)
+                complete = False
+                continue
+            if not is_recent_enough(entry, cutoff_ts):
+                complete = False
+                continue
 
-        # movie jobs are published per parent dir. transcode_mqtt resolves the
-        # output path relative to that parent, so nested source dirs are
-        # flattened to MOVIE_DST_BASE/<filename>.
-        job_root = mkv.parent
-        try:
-            rel_worker = mkv.relative_to(job_root)
-        except ValueError:
-            rel_worker = Path(mkv.name)
-        expected_dest = movie_dst_base / rel_worker
+            # movie jobs are published per parent dir. transcode_mqtt resolves the
+            # output path relative to that parent, so nested source dirs are
+            # flattened to MOVIE_DST_BASE/<filename>.
+            expected_dest = dst_prefix + entry.name
 
-        # Keep compatibility with already-existing outputs that preserve source
-        # subfolders from older/manual flows.
-        legacy_dest = movie_dst_base / mkv.relative_to(movie_src_base)
+            # Keep compatibility with already-existing outputs that preserve source
+            # subfolders from older/manual flows.
+            legacy_dest = dst_prefix + entry.path[src_prefix_len:]
 
-        if expected_dest.exists() or legacy_dest.exists():
-            continue
-        missing.setdefault(job_root, []).append(mkv)
+            if os.path.exists(expected_dest) or os.path.exists(legacy_dest):
+                continue
+            missing.setdefault(src_dir, []).append(src_dir / entry.name)
+            complete = False
+        if complete and fingerprint is not None:
+            scan_state.mark_complete("movie:" + dir_path, fingerprint)
 
+    if skipped:
+        logging.info("skipped %d temp mkv files under %s", len(skipped), movie_src_base)
     return missing, skipped
 
 
+def publish_batches(
+    client: mqtt.Client | None,
+    topic: str,
+    mode: str,
+    dirs: Dict[Path, List[Path]],
+    source_root: Path,
+    source_type_default: str,
+    marker_cache: Dict[Path, str | None],
+    *,
+    batch_size: int,
+    batch_sleep: float,
+    allow_failures: bool,
+    dry_run: bool,
+    probe_workers: int = 1,
+):
+    """
+    Prüft die MKVs jedes Verzeichnisses per ffprobe und publiziert sie in
+    Batches als MQTT-Jobs (mode "series" oder "movie"). Mit probe_workers > 1
+    laufen die ffprobe-Aufrufe der folgenden Verzeichnisse im Hintergrund,
+    während vorne schon publiziert (und zwischen Batches gewartet) wird; die
+    Reihenfolge der Jobs bleibt gleich.
+    """
+    template = {
+        "version": MQTT_PAYLOAD_VERSION,
+        "mode": mode,
+        "source_type": None,
+        "path": None,
+        "files": None,
+        "interlaced": None,
+    }
+    ordered = sorted(dirs.items())
+    with ThreadPoolExecutor(max_workers=max(1, probe_workers)) as executor:
+        probed = executor.map(
+            lambda item: filter_ready_mkvs(item[1], allow_failures), ordered
+        )
+        for (src_dir, _mkvs), probe_result in zip(ordered, probed):
+            _publish_dir(
+                client,
+                topic,
+                template,
+                src_dir,
+                probe_result,
+                source_root,
+                source_type_default,
+                marker_cache,
+                batch_size=batch_size,
+                batch_sleep=batch_sleep,
+                allow_failures=allow_failures,
+                dry_run=dry_run,
+            )
+
+
+def _publish_dir(
+    client: mqtt.Client | None,
+    topic: str,
+    template: dict,
+    src_dir: Path,
+    probe_result: Tuple[List[Path], List[Path], int | None],
+    source_root: Path,
+    source_type_default: str,
+    marker_cache: Dict[Path, str | None],
+    *,
+    batch_size: int,
+    batch_sleep: float,
+    allow_failures: bool,
+    dry_run: bool,
+):
+    ready_mkvs, dropped_mkvs, sample_height = probe_result
+    if dropped_mkvs and not allow_failures:
+        logging.info(
+            "dropping %d files from %s due to ffprobe errors: %s",
+            len(dropped_mkvs),
+            src_dir,
+            ", ".join(str(p) for p in dropped_mkvs),
+        )
+    if not ready_mkvs:
+        logging.info(
+            "skip %s because all files failed ffprobe",
+            src_dir,
+        )
+        return
+    source_type = detect_source_type(
+        src_dir,
+        source_root,
+        source_type_default,
+        ready_mkvs[0],
+        sample_height,
+        marker_cache=marker_cache,
+    )
+    dir_template = dict(template, source_type=source_type, path=str(src_dir.resolve()))
+    for batch in chunk_iter(ready_mkvs, batch_size):
+        payload = dict(dir_template, files=[str(p.resolve()) for p in batch])
+        mqtt_publish(client, topic, payload, dry_run)
+        sleep_between_batches(batch_sleep, dry_run)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Finde fehlende Transcodes und publiziere MQTT-Jobs",
@@ -321,7 +582,8 @@ def main():
             "  %(prog)s --dry-run\n"
             "  %(prog)s --batch-size 3 --batch-sleep 0.25\n"
             "ENV-Fallbacks:\n"
-            "  RESCAN_BATCH_SIZE, RESCAN_BATCH_SLEEP"
+            "  RESCAN_BATCH_SIZE, RESCAN_BATCH_SLEEP, RESCAN_STATE_FILE,\n"
+            "  RESCAN_PROBE_WORKERS"
         ),
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
@@ -352,12 +614,30 @@ def main():
         default=None,
         help="Pause in Sekunden zwischen MQTT-Jobs (Default: RESCAN_BATCH_SLEEP oder 0)",
     )
+    parser.add_argument(
+        "--probe-workers",
+        type=int,
+        default=None,
+        help=(
+            "Parallele ffprobe-Aufrufe, die dem Publizieren vorauslaufen "
+            "(Default: RESCAN_PROBE_WORKERS oder 2)"
+        ),
+    )
     parser.add_argument(
         "--days",
         type=int,
         default=None,
         help="Nur RAW-MKVs aus den letzten N Tagen beruecksichtigen (optional)",
     )
+    parser.add_argument(
+        "--state-file",
+        default=None,
+        help=(
+            "JSON-Datei mit dem Scan-Stand des letzten Laufs; unveränderte, "
+            "vollständige Verzeichnisse werden übersprungen "
+            "(Default: RESCAN_STATE_FILE, sonst aus)"
+        ),
+    )
     args = parser.parse_args()
 
     logging.basicConfig(
@@ -387,13 +667,26 @@ def main():
         if args.batch_sleep is not None
         else float(getenv("RESCAN_BATCH_SLEEP", "0"))
     )
+    probe_workers = (
+        args.probe_workers
+        if args.probe_workers is not None
+        else int(getenv("RESCAN_PROBE_WORKERS", "2"))
+    )
     if batch_size <= 0:
         raise RuntimeError("batch-size must be > 0")
+    if probe_workers <= 0:
+        raise RuntimeError("probe-workers must be > 0")
     if batch_sleep < 0:
         raise RuntimeError("batch-sleep must be >= 0")
     if args.days is not None and args.days < 0:
         raise RuntimeError("days must be >= 0")
 
+    state_file = args.state_file or getenv("RESCAN_STATE_FILE")
+    scan_state: ScanState | None = None
+    if state_file:
+        scan_state = ScanState(Path(state_file).expanduser())
+        scan_state.load()
+
     cutoff_ts: float | None = None
     cutoff_iso = "-"
     if args.days is not None:
@@ -424,7 +717,7 @@ def main():
     roots_label = ", ".join(f"{stype}={path}" for stype, path in source_roots)
     logging.info(
         "config: MQTT_TOPIC=%s, SRC_BASE=%s (roots=%s, series subpath=%s, movie subpath=%s), "
-        "SERIES_DST_BASE=%s, MOVIE_DST_BASE=%s, BATCH_SIZE=%d, BATCH_SLEEP=%ss, DAYS=%s, CUTOFF_UTC=%s",
+        "SERIES_DST_BASE=%s, MOVIE_DST_BASE=%s, BATCH_SIZE=%d, BATCH_SLEEP=%ss, PROBE_WORKERS=%d, DAYS=%s, CUTOFF_UTC=%s",
         MQTT_TOPIC,
         src_base,
         roots_label,
@@ -434,6 +727,7 @@ def main():
         movie_dst_base,
         batch_size,
         batch_sleep,
+        probe_workers,
         args.days if args.days is not None else "-",
         cutoff_iso,
     )
@@ -445,10 +739,16 @@ def main():
         series_src_base = (source_root / series_subpath).resolve()
         movie_src_base = (source_root / movie_subpath).resolve()
         series_dirs, series_skipped = collect_missing_series_dirs(
-            series_src_base, series_dst_base, cutoff_ts=cutoff_ts
+            series_src_base,
+            series_dst_base,
+            cutoff_ts=cutoff_ts,
+            scan_state=scan_state,
         )
         movie_dirs, movie_skipped = collect_missing_movie_dirs(
-            movie_src_base, movie_dst_base, cutoff_ts=cutoff_ts
+            movie_src_base,
+            movie_dst_base,
+            cutoff_ts=cutoff_ts,
+            scan_state=scan_state,
         )
         scan_results.append(
             {
@@ -461,6 +761,9 @@ def main():
         series_skipped_all.extend(series_skipped)
         movie_skipped_all.extend(movie_skipped)
 
+    if scan_state is not None:
+        scan_state.save()
+
     series_total = sum(len(result["series_dirs"]) for result in scan_results)
     movie_total = sum(len(result["movie_dirs"]) for result in scan_results)
 
@@ -497,69 +800,27 @@ def main():
     for result in scan_results:
         source_root = result["source_root"]
         source_type_default = result["source_type"]
-        for src_dir, mkvs in sorted(result["series_dirs"].items()):
-            ready_mkvs, dropped_mkvs, sample_height = filter_ready_mkvs(
-                mkvs, args.allow_ffprobe_failures
-            )
-            if dropped_mkvs and not args.allow_ffprobe_failures:
-                logging.info(
-                    "dropping %d files from %s due to ffprobe errors: %s",
-                    len(dropped_mkvs),
-                    src_dir,
-                    ", ".join(str(p) for p in dropped_mkvs),
-                )
-            if not ready_mkvs:
-                logging.info(
-                    "skip %s because all files failed ffprobe",
-                    src_dir,
-                )
-                continue
-            source_type = detect_source_type(
-                src_dir, source_root, source_type_default, ready_mkvs[0], sample_height
-            )
-            for batch in chunk_list(ready_mkvs, batch_size):
-                payload = {
-                    "version": MQTT_PAYLOAD_VERSION,
-                    "mode": "series",
-                    "source_type": source_type,
-                    "path": str(src_dir.resolve()),
-                    "files": [str(p.resolve()) for p in batch],
-                    "interlaced": None,
-                }
-                mqtt_publish(client, MQTT_TOPIC, payload, args.dry_run)
-                sleep_between_batches(batch_sleep, args.dry_run)
-
-        for parent, mkvs in sorted(result["movie_dirs"].items()):
-            ready_mkvs, dropped_mkvs, sample_height = filter_ready_mkvs(
-                mkvs, args.allow_ffprobe_failures
-            )
-            if dropped_mkvs and not args.allow_ffprobe_failures:
-                logging.info(
-                    "dropping %d files from %s due to ffprobe errors: %s",
-                    len(dropped_mkvs),
-                    parent,
-                    ", ".join(str(p) for p in dropped_mkvs),
-                )
-            if not ready_mkvs:
-                logging.info(
-                    "skip %s because all files failed ffprobe",
-                    parent,
-                )
-                continue
-            source_type = detect_source_type(
-                parent, source_root, source_type_default, ready_mkvs[0], sample_height
+        # Marker-Lookups pro Source-Root teilen: der Root-Marker wird nur
+        # einmal gelesen, tiefere .source_type-Dateien haben weiter Vorrang.
+        marker_cache: Dict[Path, str | None] = {}
+        for mode, dirs in (
+            ("series", result["series_dirs"]),
+            ("movie", result["movie_dirs"]),
+        ):
+            publish_batches(
+                client,
+                MQTT_TOPIC,
+                mode,
+                dirs,
+                source_root,
+                source_type_default,
+                marker_cache,
+                batch_size=batch_size,
+                batch_sleep=batch_sleep,
+                allow_failures=args.allow_ffprobe_failures,
+                dry_run=args.dry_run,
+                probe_workers=probe_workers,
             )
-            for batch in chunk_list(ready_mkvs, batch_size):
-                payload = {
-                    "version": MQTT_PAYLOAD_VERSION,
-                    "mode": "movie",
-                    "source_type": source_type,
-                    "path": str(parent.resolve()),
-                    "files": [str(p.resolve()) for p in batch],
-                    "interlaced": None,
-                }
-                mqtt_publish(client, MQTT_TOPIC, payload, args.dry_run)
-                sleep_between_batches(batch_sleep, args.dry_run)
 
     if client is not None:
         client.disconnect()
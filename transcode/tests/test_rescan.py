@@ -1,3 +1,4 @@
+import functools
 import importlib.util
 import os
 import tempfile
@@ -7,6 +8,7 @@ from pathlib import Path
 from unittest import mock
 
 
+@functools.lru_cache(maxsize=1)
 def load_rescan_module():
     module_path = Path(__file__).resolve().parents[1] / "rescan.py"
     spec = importlib.util.spec_from_file_location("transcode_rescan_test", module_path)
@@ -215,6 +217,65 @@ class RescanTests(unittest.TestCase):
             self.assertEqual(missing, {})
             self.assertEqual(skipped, [])
 
+    def test_iter_mkv_dirs_matches_rglob(self):
+        mod = load_rescan_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base = Path(tmpdir)
+            nested = base / "Show" / "S01" / "disc01"
+            nested.mkdir(parents=True, exist_ok=True)
+            (nested / "ep01.mkv").touch()
+            (nested / "ep01.nfo").touch()
+            (base / "top.mkv").touch()
+            (base / "link").symlink_to(nested, target_is_directory=True)
+
+            found = sorted(
+                Path(entry.path)
+                for _dir, _mtime, entries in mod.iter_mkv_dirs(base)
+                for entry in entries
+            )
+            self.assertEqual(found, sorted(base.rglob("*.mkv")))
+            self.assertEqual(found, [nested / "ep01.mkv", base / "top.mkv"])
+
+    def test_collect_missing_series_dirs_skips_unchanged_dirs_with_state(self):
+        mod = load_rescan_module()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            base = Path(tmpdir)
+            series_root = base / "raw" / "Serien"
+            series_src = series_root / "Show" / "S01" / "disc01"
+            series_dst = base / "dst-series"
+            dst_dir = series_dst / "Show" / "S01" / "disc01"
+            series_src.mkdir(parents=True, exist_ok=True)
+            dst_dir.mkdir(parents=True, exist_ok=True)
+            (series_src / "ep01.mkv").touch()
+            (dst_dir / "ep01.mkv").touch()
+            state_path = base / "state.json"
+
+            state = mod.ScanState(state_path)
+            state.load()
+            missing, _ = mod.collect_missing_series_dirs(
+                series_root, series_dst, scan_state=state
+            )
+            self.assertEqual(missing, {})
+            state.save()
+
+            state = mod.ScanState(state_path)
+            state.load()
+            with mock.patch.object(mod.os.path, "exists") as exists_mock:
+                missing, _ = mod.collect_missing_series_dirs(
+                    series_root, series_dst, scan_state=state
+                )
+                exists_mock.assert_not_called()
+            self.assertEqual(missing, {})
+
+            # Removing the output touches the destination dir mtime.
+            (dst_dir / "ep01.mkv").unlink()
+            state = mod.ScanState(state_path)
+            state.load()
+            missing, _ = mod.collect_missing_series_dirs(
+                series_root, series_dst, scan_state=state
+            )
+            self.assertEqual(missing, {series_src: [series_src / "ep01.mkv"]})
+
     def test_collect_missing_series_dirs_honors_cutoff(self):
         mod = load_rescan_module()
         with tempfile.TemporaryDirectory() as tmpdir:
@@ -1,5 +1,6 @@
 import importlib.util
 import os
+import sqlite3
 import sys
 import tempfile
 import time
@@ -73,13 +74,22 @@ def load_transcode_mqtt_module(tmpdir: Path):
 
 
 class SQLiteQueueTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # The queue does not depend on the path config, so the module (and the
+        # fake paho) is loaded once for all tests instead of per test.
+        cls._tmpdir = tempfile.TemporaryDirectory()
+        with mock.patch.dict(sys.modules, install_fake_paho()):
+            cls.mod = load_transcode_mqtt_module(Path(cls._tmpdir.name))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmpdir.cleanup()
+
     def test_sqlite_queue_roundtrip(self):
         with tempfile.TemporaryDirectory() as tmpdir:
             tmp = Path(tmpdir)
-            fake_modules = install_fake_paho()
-            with mock.patch.dict(sys.modules, fake_modules):
-                mod = load_transcode_mqtt_module(tmp)
-
+            mod = self.mod
             queue = mod.SQLiteJobQueue(tmp / "jobs.sqlite3", poll_interval=0.1)
             queue.put({"path": "/tmp/input", "mode": "series"})
 
@@ -94,10 +104,7 @@ class SQLiteQueueTests(unittest.TestCase):
     def test_sqlite_queue_reclaims_stale_claim(self):
         with tempfile.TemporaryDirectory() as tmpdir:
             tmp = Path(tmpdir)
-            fake_modules = install_fake_paho()
-            with mock.patch.dict(sys.modules, fake_modules):
-                mod = load_transcode_mqtt_module(tmp)
-
+            mod = self.mod
             queue = mod.SQLiteJobQueue(
                 tmp / "jobs.sqlite3", poll_interval=0.1, claim_ttl_seconds=1
             )
@@ -116,6 +123,103 @@ class SQLiteQueueTests(unittest.TestCase):
             self.assertEqual(reclaimed["path"], "/tmp/reclaim")
             queue.task_done(reclaimed)
 
+    def test_sqlite_queue_get_batch_claims_in_order(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            mod = self.mod
+            queue = mod.SQLiteJobQueue(tmp / "jobs.sqlite3", poll_interval=0.1)
+            for idx in range(3):
+                queue.put({"path": f"/tmp/job{idx}", "mode": "series"})
+
+            batch = queue.get_batch(2)
+            self.assertEqual([job["path"] for job in batch], ["/tmp/job0", "/tmp/job1"])
+            self.assertTrue(queue.renew_claim(batch[1]))
+
+            rest = queue.get_batch(2)
+            self.assertEqual([job["path"] for job in rest], ["/tmp/job2"])
+
+            # A claim taken over by another consumer cannot be renewed.
+            queue.conn.execute(
+                "UPDATE jobs SET claimed_ts = 1 WHERE id = ?", (batch[0]["_queue_id"],)
+            )
+            queue.conn.commit()
+            self.assertFalse(queue.renew_claim(batch[0]))
+
+            for job in batch + rest:
+                queue.task_done(job)
+            remaining = queue.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            self.assertEqual(remaining, 0)
+
+    def test_claim_renewer_keeps_running_job_claimed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            queue = self.mod.SQLiteJobQueue(
+                tmp / "jobs.sqlite3", poll_interval=0.1, claim_ttl_seconds=5
+            )
+            queue.put({"path": "/tmp/long", "mode": "series"})
+            job = queue.get()
+
+            # Pretend the claim is about to expire while the job still runs.
+            stale_ts = int(time.time()) - 10
+            queue.conn.execute(
+                "UPDATE jobs SET claimed_ts = ? WHERE id = ?",
+                (stale_ts, job["_queue_id"]),
+            )
+            queue.conn.commit()
+            job["_claimed_ts"] = stale_ts
+
+            with self.mod.ClaimRenewer(queue, job, interval=0.01):
+                deadline = time.monotonic() + 5
+                while job["_claimed_ts"] == stale_ts and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            self.assertGreater(job["_claimed_ts"], stale_ts)
+            self.assertEqual(queue._claim_jobs(1), [])
+            queue.task_done(job)
+
+    def test_sqlite_queue_claims_without_returning(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            queue = self.mod.SQLiteJobQueue(tmp / "jobs.sqlite3", poll_interval=0.1)
+            for idx in range(3):
+                queue.put({"path": f"/tmp/job{idx}", "mode": "series"})
+            with mock.patch.object(self.mod, "SQLITE_HAS_RETURNING", False):
+                batch = queue.get_batch(2)
+            self.assertEqual([job["path"] for job in batch], ["/tmp/job0", "/tmp/job1"])
+            self.assertEqual([job["path"] for job in queue.get_batch(5)], ["/tmp/job2"])
+
+    def test_sqlite_claim_gives_up_on_foreign_write_lock(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            queue = self.mod.SQLiteJobQueue(tmp / "jobs.sqlite3", poll_interval=0.1)
+            queue.put({"path": "/tmp/job0", "mode": "series"})
+
+            # Another process (rescan, an sqlite3 shell) holds the write lock.
+            other = sqlite3.connect(str(tmp / "jobs.sqlite3"))
+            other.execute("BEGIN IMMEDIATE")
+            with mock.patch.object(self.mod, "SQLITE_CLAIM_BUSY_TIMEOUT_MS", 10):
+                started = time.monotonic()
+                self.assertEqual(queue._claim_jobs(1), [])
+                self.assertLess(time.monotonic() - started, 5)
+            other.rollback()
+            other.close()
+
+            self.assertEqual([job["path"] for job in queue.get_batch(1)], ["/tmp/job0"])
+
+    def test_sqlite_probe_cache_invalidates_on_change(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            queue = self.mod.SQLiteJobQueue(tmp / "jobs.sqlite3", poll_interval=0.1)
+            data = {"video_codec": "h264", "interlaced": False}
+            queue.put_probe("/raw/a.mkv", 10, 100, data)
+            self.assertEqual(queue.get_probe("/raw/a.mkv", 10, 100), data)
+            self.assertIsNone(queue.get_probe("/raw/a.mkv", 11, 100))
+            self.assertIsNone(queue.get_probe("/raw/b.mkv", 10, 100))
+
+            # A reopened queue (service restart) still has the entry.
+            queue.conn.close()
+            reopened = self.mod.SQLiteJobQueue(tmp / "jobs.sqlite3")
+            self.assertEqual(reopened.get_probe("/raw/a.mkv", 10, 100), data)
+
 
 if __name__ == "__main__":
     unittest.main()
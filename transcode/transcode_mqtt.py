@@ -1,21 +1,33 @@
 #!/usr/bin/env python3
 
 import fcntl
+import functools
 import json
 import logging
 import os
 import queue
 import re
+import shutil
+import socket
 import sqlite3
 import subprocess
 import sys
+import tempfile
 import threading
 import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from subprocess import CalledProcessError
 
 import paho.mqtt.client as mqtt  # type: ignore
 
+try:
+    import orjson  # type: ignore
+except ModuleNotFoundError:  # pragma: no cover - optional, stdlib json fallback
+    orjson = None
+
 
 # --------------------
 # Helpers
@@ -42,41 +54,88 @@ def getenv_int(name: str, default: int, minimum: int | None = None) -> int:
     return value
 
 
-TEMP_MKV_RE = re.compile(r"^[A-Za-z0-9]{2}_[A-Za-z][0-9]{2}\.mkv$", re.IGNORECASE)
+# ffmpeg log lines are ASCII; re.ASCII keeps \d/\s off the Unicode tables.
 IDET_SINGLE_RE = re.compile(
-    r"Single frame detection:\s*TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*Progressive:\s*(\d+)\s*Undetermined:\s*(\d+)"
+    r"Single frame detection:\s*TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*Progressive:\s*(\d+)\s*Undetermined:\s*(\d+)",
+    re.ASCII,
 )
 IDET_MULTI_RE = re.compile(
-    r"Multi frame detection:\s*TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*Progressive:\s*(\d+)\s*Undetermined:\s*(\d+)"
+    r"Multi frame detection:\s*TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*Progressive:\s*(\d+)\s*Undetermined:\s*(\d+)",
+    re.ASCII,
+)
+IDET_FILTER_RE = re.compile(
+    r"^\[Parsed_idet_(\d+) @ [^\]]*\]\s*(.*)$", re.ASCII | re.MULTILINE
 )
 
 
-def is_temp_mkv(path: Path) -> bool:
-    return bool(TEMP_MKV_RE.match(path.name))
+def is_temp_mkv(path: Path | os.DirEntry) -> bool:
+    # MakeMKV temp names like "B1_t00.mkv" ([A-Za-z0-9]{2}_[A-Za-z][0-9]{2}.mkv),
+    # checked by slicing: this runs for every entry of the directory walk.
+    name = path.name
+    return (
+        len(name) == 10
+        and name.isascii()
+        and name[:2].isalnum()
+        and name[2] == "_"
+        and name[3].isalpha()
+        and name[4:6].isdigit()
+        and name[6:].lower() == ".mkv"
+    )
+
+
+def iter_mkv_entries(root: Path) -> Iterator[os.DirEntry]:
+    """
+    Yields every *.mkv entry below root like rglob does (directory symlinks
+    are not followed), without building a Path per directory entry.
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".mkv"):
+                        yield entry
+        except PermissionError as e:
+            logging.warning("cannot scan %s: %s", current, e)
 
 
 def probe_duration(path: Path) -> float | None:
     """
     Returns media duration in seconds (float) via ffprobe, or None if unavailable.
+    The first attempt reads the container header only (-find_stream_info 0:
+    Matroska keeps the duration in its segment info), so verifying a fresh
+    output does not decode frames; ffprobe builds without that option or files
+    without a header duration fall back to the full probe.
     """
-    try:
-        out = subprocess.check_output(
-            [
-                FFPROBE_BIN,
-                "-v",
-                "error",
-                "-show_entries",
-                "format=duration",
-                "-of",
-                "default=noprint_wrappers=1:nokey=1",
-                str(path),
-            ],
-            stderr=subprocess.DEVNULL,
-        )
-        return float(out.strip()) if out else None
-    except (CalledProcessError, FileNotFoundError, ValueError) as e:
-        logging.warning("ffprobe duration failed for %s: %s", path, e)
-        return None
+    error: Exception | None = None
+    for extra_args in (("-find_stream_info", "0"), ()):
+        try:
+            out = subprocess.check_output(
+                [
+                    FFPROBE_BIN,
+                    "-v",
+                    "error",
+                    *extra_args,
+                    "-show_entries",
+                    "format=duration",
+                    "-of",
+                    "default=noprint_wrappers=1:nokey=1",
+                    str(path),
+                ],
+                close_fds=False,
+                stderr=subprocess.DEVNULL,
+            )
+            return float(out.strip())
+        except FileNotFoundError as e:
+            error = e
+            break
+        except (CalledProcessError, ValueError) as e:
+            error = e
+    logging.warning("ffprobe duration failed for %s: %s", path, error)
+    return None
 
 
 def parse_idet_counts(output: str) -> tuple[int, int, int, int] | None:
@@ -89,28 +148,269 @@ def parse_idet_counts(output: str) -> tuple[int, int, int, int] | None:
     return None
 
 
-def run_idet(path: Path, frames: int) -> tuple[int, int, int, int] | None:
-    cmd = [
-        FFMPEG_BIN,
-        "-hide_banner",
-        "-v",
-        "info",
-        "-i",
-        str(path),
-        "-an",
-        "-vf",
-        "idet",
-        "-frames:v",
-        str(frames),
-        "-f",
-        "null",
-        "-",
+IdetCounts = tuple[int, int, int, int]
+
+
+def idet_windows(path: Path, frames: int) -> list[tuple[float | None, int]]:
+    """
+    Where to sample a file for idet: (input seek offset, frames). Long files
+    get short windows at IDET_SAMPLE_POINTS instead of one run from the start,
+    so the detection does not decode minutes of video (intros, studio logos).
+    """
+    duration = probe_media(path)["duration"]
+    if not duration or duration < IDET_MIN_SAMPLED_DURATION:
+        return [(None, frames)]
+    per_window = -(-frames // len(IDET_SAMPLE_POINTS))
+    return [(round(duration * point, 3), per_window) for point in IDET_SAMPLE_POINTS]
+
+
+def run_idet_inputs(
+    inputs: list[tuple[Path, float | None, int]],
+) -> list[IdetCounts | None] | None:
+    """
+    Runs idet over (path, offset, frames) inputs in one ffmpeg process: one
+    fast-seeked input, idet chain and null output each. Returns counts per
+    input, or None if ffmpeg failed.
+    """
+    cmd = [FFMPEG_BIN, "-hide_banner", "-nostats", "-v", "info"]
+    for path, offset, _frames in inputs:
+        if IDET_THREADS:
+            cmd.extend(["-threads", str(IDET_THREADS)])
+        if offset:
+            cmd.extend(["-ss", f"{offset:.3f}"])
+        cmd.extend(["-i", str(path)])
+    if IDET_THREADS:
+        cmd.extend(["-filter_complex_threads", str(IDET_THREADS)])
+    cmd.extend(
+        [
+            "-filter_complex",
+            ";".join(f"[{index}:v:0]idet[v{index}]" for index in range(len(inputs))),
+        ]
+    )
+    for index, (_path, _offset, frames) in enumerate(inputs):
+        cmd.extend(["-map", f"[v{index}]", "-frames:v", str(frames), "-f", "null", "-"])
+    # stderr is streamed: only the idet summary lines and a short tail for
+    # error reports are kept, not every decoder warning of the run.
+    idet_lines = []
+    tail: deque[str] = deque(maxlen=20)
+    with subprocess.Popen(
+        cmd,
+        close_fds=False,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+    ) as proc:
+        for line in proc.stderr:
+            if line.startswith("[Parsed_idet_"):
+                idet_lines.append(line)
+            tail.append(line)
+        returncode = proc.wait()
+    if returncode != 0:
+        logging.warning(
+            "ffmpeg idet failed for %s: %s",
+            ", ".join(sorted({str(path) for path, _offset, _frames in inputs})),
+            "".join(tail).strip(),
+        )
+        return None
+    return parse_idet_batch("".join(idet_lines), len(inputs))
+
+
+def parse_idet_batch(output: str, count: int) -> list[IdetCounts | None]:
+    # Each chain holds exactly one filter, so Parsed_idet_N belongs to input N.
+    lines_by_index: dict[int, list[str]] = {}
+    for match in IDET_FILTER_RE.finditer(output):
+        lines_by_index.setdefault(int(match.group(1)), []).append(match.group(2))
+    return [
+        parse_idet_counts("\n".join(lines_by_index.get(index, [])))
+        for index in range(count)
     ]
-    proc = subprocess.run(cmd, capture_output=True, text=True)
-    if proc.returncode != 0:
-        logging.warning("ffmpeg idet failed for %s: %s", path, proc.stderr.strip())
+
+
+def sum_idet_counts(counts: list[IdetCounts | None]) -> IdetCounts | None:
+    found = [window for window in counts if window]
+    if not found:
         return None
-    return parse_idet_counts(proc.stderr)
+    return tuple(sum(values) for values in zip(*found))
+
+
+def run_idet_batch(paths: list[Path], frames: int) -> dict[Path, IdetCounts]:
+    """
+    idet for several files in one ffmpeg process. Returns the summed window
+    counts per path; files without counts (all of them, if ffmpeg fails) are
+    left out.
+    """
+    inputs = [
+        (path, offset, window_frames)
+        for path in paths
+        for offset, window_frames in idet_windows(path, frames)
+    ]
+    if not inputs:
+        return {}
+    results = run_idet_inputs(inputs)
+    if results is None:
+        return {}
+    windows_by_path: dict[Path, list[IdetCounts | None]] = {}
+    for (path, _offset, _frames), counts in zip(inputs, results):
+        windows_by_path.setdefault(path, []).append(counts)
+    summed = {
+        path: sum_idet_counts(windows) for path, windows in windows_by_path.items()
+    }
+    return {path: counts for path, counts in summed.items() if counts}
+
+
+def run_idet(path: Path, frames: int) -> IdetCounts | None:
+    results = run_idet_inputs(
+        [
+            (path, offset, window_frames)
+            for offset, window_frames in idet_windows(path, frames)
+        ]
+    )
+    return sum_idet_counts(results) if results else None
+
+
+def format_ffmpeg_progress(block: dict[str, str], duration: float | None) -> str:
+    try:
+        done = int(block.get("out_time_us", "")) / 1_000_000
+    except ValueError:
+        done = None
+    parts = []
+    if done is not None:
+        position = time.strftime("%H:%M:%S", time.gmtime(max(0.0, done)))
+        if duration:
+            position += f" ({min(100.0, done * 100 / duration):.0f}%)"
+        parts.append(position)
+    for key in ("fps", "speed"):
+        value = block.get(key, "").strip()
+        if value and value != "N/A":
+            parts.append(f"{key}={value}")
+    return "ffmpeg progress: " + (", ".join(parts) or "started")
+
+
+class FfmpegWatchdog:
+    """
+    Kills ffmpeg when touch() has not been called for `timeout` seconds. A hung
+    ffmpeg writes nothing, so the check runs in its own thread instead of the
+    loop reading the progress pipe.
+    """
+
+    def __init__(self, proc: subprocess.Popen, timeout: float):
+        self.proc = proc
+        self.timeout = timeout
+        self.last_progress = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._watch, daemon=True)
+
+    def touch(self):
+        self.last_progress = time.monotonic()
+
+    def _watch(self):
+        interval = min(5.0, self.timeout / 4)
+        while not self.stopped.wait(interval):
+            if time.monotonic() - self.last_progress >= self.timeout:
+                logging.warning(
+                    "ffmpeg made no progress for %ss, killing it", self.timeout
+                )
+                self.proc.kill()
+                return
+
+    def __enter__(self):
+        if self.timeout:
+            self.thread.start()
+        return self
+
+    def __exit__(self, *_exc):
+        self.stopped.set()
+        return False
+
+
+def log_ffmpeg_progress(
+    stream, duration: float | None, watchdog: FfmpegWatchdog | None = None
+):
+    """
+    Reads ffmpeg's -progress key=value blocks and logs at most one line per
+    FFMPEG_PROGRESS_INTERVAL seconds (plus the final block). Blocks that move
+    out_time_us forward count as progress for the watchdog.
+    """
+    block: dict[str, str] = {}
+    last_log = time.monotonic()
+    last_out_time = None
+    for line in stream:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            continue
+        if key != "progress":
+            block[key] = value
+            continue
+        out_time = block.get("out_time_us")
+        if watchdog is not None and out_time != last_out_time:
+            watchdog.touch()
+            last_out_time = out_time
+        now = time.monotonic()
+        if value == "end" or now - last_log >= FFMPEG_PROGRESS_INTERVAL:
+            logging.info(format_ffmpeg_progress(block, duration))
+            last_log = now
+        block = {}
+
+
+def run_ffmpeg(cmd: list[str], duration: float | None = None):
+    """
+    Runs an encode built with ENCODE_GLOBAL_ARGS. Progress arrives as
+    key=value blocks on stdout and is logged at a fixed cadence; stderr goes
+    to a temp file (no second pipe to drain) and is only logged when ffmpeg
+    fails. close_fds=False skips the fd sweep before exec; every fd this
+    process opens (lock file, MQTT socket, SQLite) is O_CLOEXEC anyway.
+    With TRANSCODE_CPUS set, ffmpeg is pinned through a taskset wrapper
+    rather than a preexec_fn, which would force the slow fork path.
+    """
+    if TRANSCODE_CPUS:
+        cmd = [TASKSET_BIN, "-c", TRANSCODE_CPUS, *cmd]
+    with tempfile.TemporaryFile() as stderr_file:
+        with subprocess.Popen(
+            cmd,
+            close_fds=False,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file,
+            text=True,
+            errors="replace",
+        ) as proc:
+            with FfmpegWatchdog(proc, FFMPEG_STALL_TIMEOUT) as watchdog:
+                log_ffmpeg_progress(proc.stdout, duration, watchdog)
+                returncode = proc.wait()
+        if returncode != 0:
+            size = stderr_file.seek(0, os.SEEK_END)
+            stderr_file.seek(max(0, size - 8192))
+            stderr = stderr_file.read().decode(errors="replace").strip()
+            if stderr:
+                logging.warning(
+                    "ffmpeg stderr (last lines):\n%s",
+                    "\n".join(stderr.splitlines()[-20:]),
+                )
+            raise CalledProcessError(returncode, cmd)
+
+
+INTERLACED_FIELD_ORDERS = frozenset({"tt", "bb", "tb", "bt"})
+
+
+def drop_page_cache(path: str):
+    """
+    Tells the kernel a finished source will not be read again, so its pages
+    make room for the next file instead of pushing that out of the cache.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError as e:
+        logging.debug("posix_fadvise failed for %s: %s", path, e)
+    finally:
+        os.close(fd)
 
 
 def decide_idet(counts: tuple[int, int, int, int]) -> bool | None:
@@ -130,34 +430,17 @@ def format_idet_counts(counts: tuple[int, int, int, int]) -> str:
     return f"TFF={tff} BFF={bff} Progressive={progressive} Undetermined={undetermined}"
 
 
-def detect_interlaced(path: Path) -> bool | None:
+def detect_interlaced(
+    path: Path, idet_counts: tuple[int, int, int, int] | None = None
+) -> bool | None:
     """
     Returns True if metadata or idet indicates interlaced, False if progressive,
-    None when detection fails.
+    None when detection fails. idet_counts from run_idet_batch save the
+    per-file idet run.
     """
-    field_order = ""
-    try:
-        out = subprocess.check_output(
-            [
-                FFPROBE_BIN,
-                "-v",
-                "error",
-                "-select_streams",
-                "v:0",
-                "-show_entries",
-                "stream=field_order",
-                "-of",
-                "default=noprint_wrappers=1:nokey=1",
-                str(path),
-            ],
-            stderr=subprocess.DEVNULL,
-        ).decode()
-        field_order = out.strip().lower()
-    except Exception as e:
-        logging.warning("ffprobe field_order failed for %s: %s", path, e)
+    field_order = probe_media(path)["field_order"]
 
-    interlaced_meta = {"tt", "bb", "tb", "bt"}
-    if field_order in interlaced_meta:
+    if field_order in INTERLACED_FIELD_ORDERS:
         logging.info(
             "interlace decision: interlaced (reason=meta-data field_order=%s) for %s",
             field_order,
@@ -165,8 +448,8 @@ def detect_interlaced(path: Path) -> bool | None:
         )
         return True
 
-    frames = max(50, int(getenv("IDET_FRAMES", "500")))
-    idet_counts = run_idet(path, frames)
+    if idet_counts is None:
+        idet_counts = run_idet(path, IDET_FRAMES)
     idet_decision = decide_idet(idet_counts) if idet_counts else None
 
     if idet_decision is True:
@@ -207,102 +490,144 @@ def detect_interlaced(path: Path) -> bool | None:
     return None
 
 
-def probe_audio_streams(path: Path) -> list[dict]:
+def parse_media_probe(data: dict) -> dict:
     """
-    Returns audio streams with index, channels, and language tags (if present).
+    Extracts what transcode_dir needs from `ffprobe -of json` stream/format
+    output: first video stream codec and field order, audio streams with
+    index/channels/language, subtitle streams with index/language, duration.
     """
-    try:
-        out = subprocess.check_output(
-            [
-                FFPROBE_BIN,
-                "-v",
-                "error",
-                "-select_streams",
-                "a",
-                "-show_entries",
-                "stream=index,channels:stream_tags=language",
-                "-of",
-                "json",
-                str(path),
-            ],
-            stderr=subprocess.DEVNULL,
-        ).decode()
-        data = json.loads(out)
-        streams = []
-        for stream in data.get("streams", []):
-            streams.append(
+    media = {
+        "video_codec": None,
+        "field_order": "",
+        "audio_streams": [],
+        "subtitle_streams": [],
+        "duration": None,
+    }
+    for stream in data.get("streams", []):
+        codec_type = stream.get("codec_type")
+        language = (stream.get("tags", {}) or {}).get("language")
+        if codec_type == "video":
+            if media["video_codec"] is None:
+                media["video_codec"] = (stream.get("codec_name") or "").lower() or None
+                media["field_order"] = (stream.get("field_order") or "").lower()
+        elif codec_type == "audio":
+            media["audio_streams"].append(
                 {
                     "index": stream.get("index"),
                     "channels": stream.get("channels"),
-                    "language": (stream.get("tags", {}) or {}).get("language"),
+                    "language": language,
                 }
             )
-        return streams
+        elif codec_type == "subtitle":
+            media["subtitle_streams"].append(
+                {"index": stream.get("index"), "language": language}
+            )
+    try:
+        media["duration"] = float((data.get("format") or {})["duration"])
+    except (KeyError, TypeError, ValueError):
+        pass
+    return media
+
+
+# Optional persistent store for probe results (the SQLite job queue), set by
+# main() when JOB_QUEUE_BACKEND=sqlite.
+PROBE_STORE = None
+
+
+@functools.lru_cache(maxsize=256)
+def _probe_media_cached(path: str, mtime_ns: int, size: int) -> dict:
+    if PROBE_STORE is not None:
+        stored = PROBE_STORE.get_probe(path, mtime_ns, size)
+        if stored is not None:
+            return stored
+    media = _run_media_probe(path)
+    if PROBE_STORE is not None:
+        PROBE_STORE.put_probe(path, mtime_ns, size, media)
+    return media
+
+
+def _run_media_probe(path: str) -> dict:
+    out = subprocess.check_output(
+        [
+            FFPROBE_BIN,
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration:stream=index,codec_type,codec_name,channels,"
+            "field_order:stream_tags=language",
+            "-of",
+            "json",
+            path,
+        ],
+        close_fds=False,
+        stderr=subprocess.DEVNULL,
+    )
+    return parse_media_probe(decode_payload(out))
+
+
+def probe_media(path: Path) -> dict:
+    """
+    One ffprobe run for all source metadata, cached per (path, mtime, size) so
+    retries and repeated jobs for an unchanged file do not probe again.
+    Failures are not cached and yield the defaults of an empty probe, marked
+    with "probe_failed" so they are never persisted either. With a PROBE_STORE
+    the result (plus the interlace decision, see remember_interlaced) also
+    survives restarts.
+    """
+    path_s = os.fspath(path)
+    try:
+        st = os.stat(path_s)
+        key = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = None
+    try:
+        if key is None:
+            return _run_media_probe(path_s)
+        return _probe_media_cached(path_s, *key)
     except Exception as e:
-        logging.warning("ffprobe audio streams failed for %s: %s", path, e)
-        return []
+        logging.warning("ffprobe failed for %s: %s", path, e)
+        return {**parse_media_probe({}), "probe_failed": True}
+
+
+def remember_interlaced(path: Path, media: dict, interlaced: bool):
+    """
+    Stores an interlace decision next to the cached probe result of path, so
+    retries and later jobs for the unchanged file skip idet. Nothing is kept
+    for a failed probe: storing its empty defaults would hide the file's
+    streams from every later lookup.
+    """
+    if media.get("probe_failed"):
+        return
+    media["interlaced"] = interlaced
+    if PROBE_STORE is None:
+        return
+    path_s = os.fspath(path)
+    try:
+        st = os.stat(path_s)
+    except OSError:
+        return
+    PROBE_STORE.put_probe(path_s, st.st_mtime_ns, st.st_size, media)
+
+
+def probe_audio_streams(path: Path) -> list[dict]:
+    """
+    Returns audio streams with index, channels, and language tags (if present).
+    """
+    return probe_media(path)["audio_streams"]
 
 
 def probe_subtitle_streams(path: Path) -> list[dict]:
     """
     Returns subtitle streams with index and language tags (if present).
     """
-    try:
-        out = subprocess.check_output(
-            [
-                FFPROBE_BIN,
-                "-v",
-                "error",
-                "-select_streams",
-                "s",
-                "-show_entries",
-                "stream=index:stream_tags=language",
-                "-of",
-                "json",
-                str(path),
-            ],
-            stderr=subprocess.DEVNULL,
-        ).decode()
-        data = json.loads(out)
-        streams = []
-        for stream in data.get("streams", []):
-            streams.append(
-                {
-                    "index": stream.get("index"),
-                    "language": (stream.get("tags", {}) or {}).get("language"),
-                }
-            )
-        return streams
-    except Exception as e:
-        logging.warning("ffprobe subtitle streams failed for %s: %s", path, e)
-        return []
+    return probe_media(path)["subtitle_streams"]
 
 
 def probe_video_codec(path: Path) -> str | None:
     """
     Returns the codec name of the first video stream, if available.
     """
-    try:
-        out = subprocess.check_output(
-            [
-                FFPROBE_BIN,
-                "-v",
-                "error",
-                "-select_streams",
-                "v:0",
-                "-show_entries",
-                "stream=codec_name",
-                "-of",
-                "default=noprint_wrappers=1:nokey=1",
-                str(path),
-            ],
-            stderr=subprocess.DEVNULL,
-        ).decode()
-        codec = out.strip().lower()
-        return codec or None
-    except Exception as e:
-        logging.warning("ffprobe video codec failed for %s: %s", path, e)
-        return None
+    return probe_media(path)["video_codec"]
 
 
 def build_audio_args(
@@ -403,13 +728,47 @@ MQTT_USER = getenv("MQTT_USER", required=True)
 MQTT_PASSWORD = getenv("MQTT_PASSWORD", required=True)
 MQTT_TOPIC = getenv("MQTT_TOPIC", "media/rip/done")
 MQTT_SSL = getenv_bool("MQTT_SSL", "false")
+MQTT_CLIENT_ID = getenv("MQTT_CLIENT_ID", f"transcode-mqtt-{socket.gethostname()}")
 
 MQTT_TOPIC_START = getenv("MQTT_TOPIC_START", "media/transcode/start")
 MQTT_TOPIC_DONE = getenv("MQTT_TOPIC_DONE", "media/transcode/done")
 MQTT_TOPIC_ERROR = getenv("MQTT_TOPIC_ERROR", "media/transcode/error")
 MQTT_PAYLOAD_VERSION = 3
+MQTT_BATCHED = getenv_bool("MQTT_BATCHED", "false")
+# start/done are plain status updates; errors always go out with QoS 1.
+MQTT_STATUS_QOS = getenv_int("MQTT_STATUS_QOS", 0, minimum=0)
+if MQTT_STATUS_QOS > 2:
+    raise RuntimeError(f"MQTT_STATUS_QOS must be 0, 1 or 2, got {MQTT_STATUS_QOS}")
 ENABLE_SW_FALLBACK = getenv_bool("ENABLE_SW_FALLBACK", "true")
 MAX_HW_RETRIES = max(0, int(getenv("MAX_HW_RETRIES", "2")))
+# Compare input and output duration after each encode (one header-only ffprobe).
+VERIFY_OUTPUT_DURATION = getenv_bool("VERIFY_OUTPUT_DURATION", "true")
+IDET_FRAMES = max(50, getenv_int("IDET_FRAMES", 500))
+# Decoder/filter threads per idet input; idet runs next to an encode, so keep
+# it off the encoder's cores. 0 lets ffmpeg decide.
+IDET_THREADS = getenv_int("IDET_THREADS", 1, minimum=0)
+# idet samples files longer than IDET_MIN_SAMPLED_DURATION seconds at these
+# relative positions (IDET_FRAMES split across the windows).
+IDET_SAMPLE_POINTS = (0.2, 0.5, 0.8)
+IDET_MIN_SAMPLED_DURATION = 120.0
+# Files per ffmpeg process when idet runs for a whole job (each file adds one
+# input per sample window).
+IDET_BATCH_SIZE = 4
+# Threads for ffprobe/idet preflight next to the encode: one for the next
+# file's probe, one for the job-wide idet batch.
+PREFLIGHT_WORKERS = 2
+# Global options of every encode: no interactive stats on stderr, machine
+# readable progress on stdout (see run_ffmpeg).
+# -y: the partial output already exists while its lock is held, see
+# lock_partial_output.
+ENCODE_GLOBAL_ARGS = ("-y", "-nostats", "-progress", "pipe:1")
+FFMPEG_PROGRESS_INTERVAL = 60.0
+# Kill an encode whose output position has not moved for this many seconds
+# (e.g. after a GPU hang) so the retry/fallback chain takes over; 0 disables.
+FFMPEG_STALL_TIMEOUT = getenv_int("FFMPEG_STALL_TIMEOUT", 300, minimum=0)
+# Optional CPU list (taskset -c syntax, e.g. "0-3") to pin ffmpeg encodes to;
+# "gpu" means the CPUs of the NUMA node the render device hangs off.
+TRANSCODE_CPUS = getenv("TRANSCODE_CPUS", "").strip()
 ENABLE_AAC_DOWNMIX = getenv_bool("ENABLE_AAC_DOWNMIX", "false")
 AUDIO_MODE = getenv("AUDIO_MODE", "auto").strip().lower()
 QSV_DIRECT = getenv_bool("QSV_DIRECT", "false")
@@ -417,8 +776,17 @@ QSV_GLOBAL_QUALITY_BLURAY = getenv_int("QSV_GLOBAL_QUALITY_BLURAY", 20, minimum=
 QSV_GLOBAL_QUALITY_DVD = getenv_int("QSV_GLOBAL_QUALITY_DVD", 21, minimum=1)
 VAAPI_QP_BLURAY = getenv_int("VAAPI_QP_BLURAY", 21, minimum=0)
 VAAPI_QP_DVD = getenv_int("VAAPI_QP_DVD", 22, minimum=0)
+# Frames in flight to the hevc_vaapi encoder (ffmpeg's default is 2).
+VAAPI_ASYNC_DEPTH = getenv_int("VAAPI_ASYNC_DEPTH", 4, minimum=1)
+# Low-power (fixed-function) HEVC encode: auto asks vainfo once per process.
+VAAPI_LOW_POWER = getenv("VAAPI_LOW_POWER", "auto").strip().lower()
+if VAAPI_LOW_POWER not in {"auto", "true", "false"}:
+    raise RuntimeError("VAAPI_LOW_POWER must be 'auto', 'true' or 'false'")
 X265_CRF_BLURAY = getenv_int("X265_CRF_BLURAY", 20, minimum=0)
 X265_CRF_DVD = getenv_int("X265_CRF_DVD", 21, minimum=0)
+# Extra x265 options for the software fallback (-x265-params syntax, e.g.
+# "asm=avx512:pmode=1"); empty keeps x265's own CPU detection and threading.
+X265_PARAMS = getenv("X265_PARAMS", "").strip()
 if AUDIO_MODE not in {"auto", "encode", "copy"}:
     raise RuntimeError("AUDIO_MODE must be 'auto', 'encode' or 'copy'")
 AUDIO_LANGS = parse_langs(getenv("AUDIO_LANGS"), "eng,ger,deu")
@@ -429,6 +797,11 @@ JOB_QUEUE_SQLITE_PATH = Path(
 ).expanduser()
 JOB_QUEUE_POLL_INTERVAL = max(0.1, float(getenv("JOB_QUEUE_POLL_INTERVAL", "1.0")))
 JOB_QUEUE_CLAIM_TTL = max(5, int(getenv("JOB_QUEUE_CLAIM_TTL", "300")))
+JOB_QUEUE_BATCH_SIZE = getenv_int("JOB_QUEUE_BATCH_SIZE", 8, minimum=1)
+# Jobs processed at the same time. Hardware encodes still wait for a
+# VAAPI_CONCURRENCY slot, but probes, idet, output checks and software
+# fallbacks of another job overlap with them.
+WORKER_THREADS = getenv_int("WORKER_THREADS", 1, minimum=1)
 if JOB_QUEUE_BACKEND not in {"memory", "sqlite"}:
     raise RuntimeError("JOB_QUEUE_BACKEND must be 'memory' or 'sqlite'")
 
@@ -449,25 +822,39 @@ MOVIE_SUBPATH = Path(getenv("MOVIE_SUBPATH", "Filme"))
 if MOVIE_SUBPATH.is_absolute():
     raise RuntimeError("MOVIE_SUBPATH must be relative")
 MOVIE_DST_BASE = Path(getenv("MOVIE_DST_BASE", "/media/Filme")).expanduser().resolve()
+VAAPI_LOCK_PATH = Path("/var/lock/vaapi.lock")
+# Concurrent hardware encodes allowed across all instances on this host.
+VAAPI_CONCURRENCY = getenv_int("VAAPI_CONCURRENCY", 1, minimum=1)
 
 
 # --------------------
 # MQTT helpers
 # --------------------
-def mqtt_publish(client, topic, payload):
-    client.publish(topic, json.dumps(payload), qos=1, retain=False)
+def encode_payload(payload: dict) -> bytes:
+    # Always bytes, so paho publishes the buffer as-is instead of encoding a str.
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
 
 
-def connect_mqtt(client: mqtt.Client):
-    while True:
-        try:
-            logging.info("connecting to MQTT broker…")
-            client.connect(MQTT_HOST, MQTT_PORT, 60)
-            logging.info("MQTT connected")
-            return
-        except OSError as e:
-            logging.warning(f"MQTT connect failed: {e}, retrying in 5s")
-            time.sleep(5)
+def decode_payload(raw: bytes):
+    # Both parsers take bytes directly (MQTT payloads, ffprobe output), so
+    # there is no .decode() copy; str from SQLite works as well.
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def status_payload(**fields) -> dict:
+    """
+    Builds a media/transcode/* payload. ts is taken here, once per event, so
+    start/done/error carry the time the event actually happened.
+    """
+    return {"version": MQTT_PAYLOAD_VERSION, **fields, "ts": int(time.time())}
+
+
+def mqtt_publish(client, topic, payload, qos: int = 1):
+    client.publish(topic, encode_payload(payload), qos=qos, retain=False)
 
 
 def build_mqtt_client() -> mqtt.Client:
@@ -475,36 +862,173 @@ def build_mqtt_client() -> mqtt.Client:
     callback_version = getattr(mqtt, "CallbackAPIVersion", None)
     if callback_version:
         kwargs["callback_api_version"] = callback_version.VERSION2
-    client = mqtt.Client(**kwargs)
+    # Persistent session: the broker keeps the subscription (and queues QoS 1
+    # rip events) across reconnects, so a reconnect is a bare CONNECT/CONNACK.
+    client = mqtt.Client(client_id=MQTT_CLIENT_ID, clean_session=False, **kwargs)
     client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
     if MQTT_SSL:
         client.tls_set()
         logging.info("MQTT TLS enabled")
+    client.reconnect_delay_set(min_delay=1, max_delay=30)
     return client
 
 
+def find_executable(name: str) -> str:
+    """
+    Looks a binary up on PATH once at startup. subprocess only takes the
+    posix_spawn fast path (no fork of this process) for an executable given
+    with a directory, so bare names are turned into absolute paths here.
+    """
+    return shutil.which(name) or name
+
+
 def resolve_ffmpeg_bin() -> str:
     explicit = os.getenv("FFMPEG_BIN")
     if explicit:
-        return explicit
+        return find_executable(explicit)
     jellyfin = Path("/usr/lib/jellyfin-ffmpeg/ffmpeg")
     if jellyfin.exists():
         return str(jellyfin)
-    return "ffmpeg"
+    return find_executable("ffmpeg")
 
 
 def resolve_ffprobe_bin() -> str:
     explicit = os.getenv("FFPROBE_BIN")
     if explicit:
-        return explicit
+        return find_executable(explicit)
     jellyfin = Path("/usr/lib/jellyfin-ffmpeg/ffprobe")
     if jellyfin.exists():
         return str(jellyfin)
-    return "ffprobe"
+    return find_executable("ffprobe")
 
 
 FFMPEG_BIN = resolve_ffmpeg_bin()
 FFPROBE_BIN = resolve_ffprobe_bin()
+TASKSET_BIN = find_executable("taskset")
+
+# Invariant hardware init arguments of the ffmpeg command lines.
+HW_DEVICE = "/dev/dri/renderD128"
+
+
+def gpu_local_cpus(device: str, sys_root: Path = Path("/sys")) -> str:
+    """
+    CPU list of the NUMA node the render device is attached to, or "" on
+    single-node machines (numa_node -1) and when sysfs has no answer.
+    """
+    node_file = sys_root / "class" / "drm" / Path(device).name / "device" / "numa_node"
+    try:
+        node = int(node_file.read_text())
+        if node < 0:
+            return ""
+        cpulist = sys_root / "devices" / "system" / "node" / f"node{node}" / "cpulist"
+        return cpulist.read_text().strip()
+    except (OSError, ValueError):
+        return ""
+
+
+if TRANSCODE_CPUS == "gpu":
+    TRANSCODE_CPUS = gpu_local_cpus(HW_DEVICE)
+    logging.info("TRANSCODE_CPUS=gpu -> %s", TRANSCODE_CPUS or "no pinning")
+if QSV_DIRECT:
+    QSV_INPUT_ARGS = (
+        "-hwaccel",
+        "qsv",
+        "-qsv_device",
+        HW_DEVICE,
+        "-hwaccel_output_format",
+        "qsv",
+    )
+else:
+    QSV_INPUT_ARGS = (
+        "-init_hw_device",
+        f"vaapi=va:{HW_DEVICE}",
+        "-init_hw_device",
+        "qsv=qsv@va",
+        "-filter_hw_device",
+        "qsv",
+    )
+VAAPI_INPUT_ARGS = (
+    "-init_hw_device",
+    f"vaapi=va:{HW_DEVICE}",
+    "-filter_hw_device",
+    "va",
+)
+
+
+def parse_vainfo_low_power(output: str, profile: str) -> bool:
+    """
+    True if vainfo lists the low-power encode entrypoint for profile, i.e. a
+    line like "VAProfileHEVCMain10 : VAEntrypointEncSliceLP".
+    """
+    for line in output.splitlines():
+        name, sep, entrypoint = line.partition(":")
+        if (
+            sep
+            and name.strip() == profile
+            and entrypoint.strip() == "VAEntrypointEncSliceLP"
+        ):
+            return True
+    return False
+
+
+def hw_device_available() -> bool:
+    """
+    Opens the VAAPI device with one tiny ffmpeg run. Checked once per job so a
+    host whose driver or render node is gone goes straight to the software
+    encoder instead of failing every hardware attempt of every file.
+    """
+    cmd = [
+        FFMPEG_BIN,
+        "-v",
+        "error",
+        "-init_hw_device",
+        f"vaapi=va:{HW_DEVICE}",
+        "-f",
+        "lavfi",
+        "-i",
+        "nullsrc=s=64x64",
+        "-frames:v",
+        "1",
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        subprocess.run(
+            cmd,
+            check=True,
+            close_fds=False,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=30,
+        )
+    except (CalledProcessError, OSError, subprocess.TimeoutExpired) as e:
+        logging.warning("VAAPI device %s unusable: %s", HW_DEVICE, e)
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def vaapi_low_power_supported() -> bool:
+    if VAAPI_LOW_POWER != "auto":
+        return VAAPI_LOW_POWER == "true"
+    try:
+        out = subprocess.check_output(
+            [find_executable("vainfo"), "--display", "drm", "--device", HW_DEVICE],
+            close_fds=False,
+            stdin=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            errors="replace",
+            timeout=30,
+        )
+    except (CalledProcessError, OSError, subprocess.TimeoutExpired) as e:
+        logging.info("vainfo unavailable (%s), not using VAAPI low-power encode", e)
+        return False
+    supported = parse_vainfo_low_power(out, "VAProfileHEVCMain10")
+    logging.info("VAAPI low-power HEVC encode %s", "on" if supported else "off")
+    return supported
 
 
 def series_src_base_for_source(source_type: str) -> Path:
@@ -534,6 +1058,16 @@ def infer_source_type_from_path(path: Path) -> str | None:
     return None
 
 
+# UPDATE ... RETURNING needs SQLite 3.35+.
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+# Busy timeout (ms) of the claim transaction. It runs under the queue lock
+# that put() on the MQTT network thread needs too, so it gives up quickly on
+# a write lock held by another process and retries after the poll interval.
+SQLITE_CLAIM_BUSY_TIMEOUT_MS = 1000
+SQLITE_BUSY_TIMEOUT_MS = 30000
+
+
 class SQLiteJobQueue:
     def __init__(
         self, db_path: Path, poll_interval: float = 1.0, claim_ttl_seconds: int = 300
@@ -542,9 +1076,18 @@ class SQLiteJobQueue:
         self.poll_interval = poll_interval
         self.claim_ttl_seconds = claim_ttl_seconds
         self.db_path.parent.mkdir(parents=True, exist_ok=True)
-        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        # timeout is SQLite's busy_timeout: wait up to 30s for another writer
+        # (e.g. a second instance on the same database) instead of failing
+        # with "database is locked" after the 5s default.
+        self.conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+        )
         self.conn.execute("PRAGMA journal_mode=WAL")
         self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS jobs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -556,6 +1099,15 @@ class SQLiteJobQueue:
         self.conn.execute(
             "CREATE INDEX IF NOT EXISTS idx_jobs_claimed_id ON jobs (claimed_ts, id)"
         )
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS probe_cache (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                created_ts INTEGER NOT NULL
+            )
+            """)
         self.conn.commit()
         self.lock = threading.Lock()
         self.not_empty = threading.Condition(self.lock)
@@ -572,60 +1124,144 @@ class SQLiteJobQueue:
             self.not_empty.notify()
 
     def get(self):
+        return self.get_batch(1)[0]
+
+    def get_batch(self, max_items: int) -> list[dict]:
+        """
+        Blocks until at least one job is available and claims up to max_items
+        jobs in a single transaction.
+        """
         while True:
             with self.not_empty:
-                claimed = self._claim_next_job()
-                if claimed is not None:
+                claimed = self._claim_jobs(max(1, max_items))
+                if claimed:
                     return claimed
                 self.not_empty.wait(timeout=self.poll_interval)
 
-    def _claim_next_job(self):
-        reclaim_before = int(time.time()) - self.claim_ttl_seconds
-        row = self.conn.execute(
-            """
-            SELECT id, payload
-            FROM jobs
-            WHERE claimed_ts IS NULL OR claimed_ts < ?
-            ORDER BY id ASC
-            LIMIT 1
-            """,
-            (reclaim_before,),
-        ).fetchone()
-        if row is None:
-            return None
+    def _claim_jobs(self, limit: int) -> list[dict]:
+        claimed_ts = int(time.time())
+        reclaim_before = claimed_ts - self.claim_ttl_seconds
+        self.conn.execute(f"PRAGMA busy_timeout={SQLITE_CLAIM_BUSY_TIMEOUT_MS}")
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            logging.debug("job queue busy, retrying claim later: %s", e)
+            return []
+        finally:
+            self.conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        try:
+            if SQLITE_HAS_RETURNING:
+                rows = self.conn.execute(
+                    """
+                    UPDATE jobs SET claimed_ts = ?
+                    WHERE id IN (
+                        SELECT id
+                        FROM jobs
+                        WHERE claimed_ts IS NULL OR claimed_ts < ?
+                        ORDER BY id ASC
+                        LIMIT ?
+                    )
+                    RETURNING id, payload
+                    """,
+                    (claimed_ts, reclaim_before, limit),
+                ).fetchall()
+                # RETURNING does not guarantee an order.
+                rows.sort(key=lambda row: row[0])
+            else:
+                rows = self.conn.execute(
+                    """
+                    SELECT id, payload
+                    FROM jobs
+                    WHERE claimed_ts IS NULL OR claimed_ts < ?
+                    ORDER BY id ASC
+                    LIMIT ?
+                    """,
+                    (reclaim_before, limit),
+                ).fetchall()
+                if rows:
+                    self.conn.executemany(
+                        "UPDATE jobs SET claimed_ts = ? WHERE id = ?",
+                        [(claimed_ts, row[0]) for row in rows],
+                    )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
 
-        job_id = int(row[0])
+        jobs = []
+        for row in rows:
+            job_id = int(row[0])
+            try:
+                payload = decode_payload(row[1])
+            except Exception:
+                logging.exception(
+                    "invalid queued payload in SQLite queue, dropping id=%s", job_id
+                )
+                self._delete(job_id)
+                continue
+            if not isinstance(payload, dict):
+                logging.warning(
+                    "queued payload is not an object, dropping id=%s", job_id
+                )
+                self._delete(job_id)
+                continue
+            payload["_queue_id"] = job_id
+            payload["_claimed_ts"] = claimed_ts
+            jobs.append(payload)
+        return jobs
+
+    def renew_claim(self, job: dict) -> bool:
+        """
+        Refreshes the claim of a job that waited in a claimed batch. Returns
+        False if the claim expired and another consumer took the job over.
+        """
+        job_id = job.get("_queue_id")
         claimed_ts = int(time.time())
-        cur = self.conn.execute(
-            """
-            UPDATE jobs
-            SET claimed_ts = ?
-            WHERE id = ? AND (claimed_ts IS NULL OR claimed_ts < ?)
-            """,
-            (claimed_ts, job_id, reclaim_before),
-        )
-        if cur.rowcount != 1:
+        with self.lock:
+            cur = self.conn.execute(
+                "UPDATE jobs SET claimed_ts = ? WHERE id = ? AND claimed_ts = ?",
+                (claimed_ts, job_id, job.get("_claimed_ts")),
+            )
             self.conn.commit()
-            return None
-        self.conn.commit()
+        if cur.rowcount != 1:
+            return False
+        job["_claimed_ts"] = claimed_ts
+        return True
 
+    def get_probe(self, path: str, mtime_ns: int, size: int) -> dict | None:
+        """
+        Returns the stored probe result for path, or None if there is none or
+        the file changed (mtime/size) since it was stored.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT data FROM probe_cache WHERE path = ? AND mtime_ns = ? AND size = ?",
+                (path, mtime_ns, size),
+            ).fetchone()
+        if row is None:
+            return None
         try:
-            payload = json.loads(row[1])
-        except Exception:
-            logging.exception(
-                "invalid queued payload in SQLite queue, dropping id=%s", job_id
+            return decode_payload(row[0])
+        except ValueError:
+            return None
+
+    def put_probe(self, path: str, mtime_ns: int, size: int, data: dict):
+        payload = json.dumps(data, separators=(",", ":"))
+        with self.lock:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO probe_cache (path, mtime_ns, size, data, created_ts)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (path, mtime_ns, size, payload, int(time.time())),
             )
-            self.conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
             self.conn.commit()
-            return None
 
-        if isinstance(payload, dict):
-            payload["_queue_id"] = job_id
-            return payload
-        logging.warning("queued payload is not an object, dropping id=%s", job_id)
+    def _delete(self, job_id: int):
         self.conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
         self.conn.commit()
-        return None
 
     def task_done(self, job: dict):
         job_id = job.get("_queue_id") if isinstance(job, dict) else None
@@ -633,13 +1269,326 @@ class SQLiteJobQueue:
             logging.warning("SQLite queue task_done without _queue_id")
             return
         with self.lock:
-            self.conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
-            self.conn.commit()
+            self._delete(job_id)
+
+
+class ClaimRenewer:
+    """
+    Renews the SQLite claim of a running job every third of the claim TTL,
+    so another worker or instance does not take a long encode for an
+    abandoned job and start it a second time.
+    """
+
+    def __init__(self, job_queue: SQLiteJobQueue, job: dict, interval=None):
+        self.job_queue = job_queue
+        self.job = job
+        self.interval = interval or max(1.0, job_queue.claim_ttl_seconds / 3)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._run,
+            name=f"{threading.current_thread().name}-claim",
+            daemon=True,
+        )
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                renewed = self.job_queue.renew_claim(self.job)
+            except sqlite3.Error as e:
+                logging.warning(
+                    "could not renew claim for %s: %s", self.job.get("path"), e
+                )
+                continue
+            if not renewed:
+                logging.warning(
+                    "claim for running job %s was taken over", self.job.get("path")
+                )
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_exc):
+        self.stopped.set()
+        self.thread.join()
+        return False
 
 
 # --------------------
 # Transcode Logic
 # --------------------
+class DoneReporter:
+    """
+    Publishes media/transcode/done per finished file, or with MQTT_BATCHED
+    once per job listing all finished outputs under "files".
+    """
+
+    def __init__(self, client, batched: bool):
+        self.client = client
+        self.batched = batched
+        self.files: list[str] = []
+
+    def done(self, out: str | os.PathLike):
+        out = os.fspath(out)
+        if not self.batched:
+            mqtt_publish(
+                self.client,
+                MQTT_TOPIC_DONE,
+                status_payload(file=out),
+                qos=MQTT_STATUS_QOS,
+            )
+            return
+        self.files.append(out)
+
+    def flush(self):
+        if not self.files:
+            return
+        mqtt_publish(
+            self.client,
+            MQTT_TOPIC_DONE,
+            status_payload(files=self.files),
+            qos=MQTT_STATUS_QOS,
+        )
+        self.files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.flush()
+        return False
+
+
+def resolve_job_files(raw_files: list[str]) -> list[Path]:
+    """
+    Resolves the files of a job, dropping duplicates (the same file listed
+    twice or reached through a symlinked directory) in first-seen order. Rip
+    jobs list many files from a few directories, so each directory is
+    resolved (one realpath walk) once and the file names are joined onto it.
+    """
+    real_dirs: dict[str, Path] = {}
+    files: dict[Path, None] = {}
+    for raw in raw_files:
+        head, name = os.path.split(os.path.expanduser(raw))
+        real_dir = real_dirs.get(head)
+        if real_dir is None:
+            real_dir = real_dirs[head] = Path(head or ".").resolve()
+        files[real_dir / name] = None
+    return list(files)
+
+
+def partial_output_path(out: Path) -> Path:
+    """
+    Hidden name ffmpeg writes to until the encode is complete; keeps the
+    .mkv suffix so ffmpeg still picks the Matroska muxer.
+    """
+    return out.with_name(f".{out.stem}.partial{out.suffix}")
+
+
+def lock_partial_output(part: Path) -> int | None:
+    """
+    Opens (creating if needed) the partial output and takes an exclusive
+    flock on it, so only one encode in this or any other process writes a
+    given output. Returns the fd, or None if another encode holds the lock.
+    The file stays in place while locked (unlinking it would let the next
+    writer lock a fresh inode); ffmpeg overwrites it through -y.
+    """
+    fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def probe_source(
+    mkv: Path,
+    interlaced: bool | None,
+    idet_counts: tuple[int, int, int, int] | None = None,
+) -> tuple[bool | None, str | None, list[dict], list[dict], float | None]:
+    """
+    Everything transcode_dir needs to know about a source before encoding it:
+    (interlaced, video codec, audio streams, subtitle streams, duration).
+    """
+    media = probe_media(mkv)
+    if interlaced is None:
+        interlaced = media.get("interlaced")
+    if interlaced is None:
+        interlaced = detect_interlaced(mkv, idet_counts)
+        if interlaced is not None:
+            remember_interlaced(mkv, media, interlaced)
+    return (
+        interlaced,
+        media["video_codec"],
+        media["audio_streams"],
+        media["subtitle_streams"],
+        media["duration"],
+    )
+
+
+def idet_counts_for(mkv_files: list[Path]) -> dict[Path, tuple[int, int, int, int]]:
+    """
+    Batched idet for every file whose metadata does not already say it is
+    interlaced (detect_interlaced would not look at idet for those) and that
+    has no remembered decision.
+    """
+    todo = []
+    for mkv in mkv_files:
+        media = probe_media(mkv)
+        if media.get("interlaced") is not None:
+            continue
+        if media["field_order"] not in INTERLACED_FIELD_ORDERS:
+            todo.append(mkv)
+    counts = {}
+    for start in range(0, len(todo), IDET_BATCH_SIZE):
+        counts.update(
+            run_idet_batch(todo[start : start + IDET_BATCH_SIZE], IDET_FRAMES)
+        )
+    return counts
+
+
+def plan_outputs(
+    mkv_files: list[Path],
+    mode: str,
+    src_root: Path | None,
+    series_src_base: Path,
+) -> list[tuple[Path, Path]]:
+    """
+    Maps every source MKV of a job to its output path. Series files outside
+    the configured series base (and outside the job root) are skipped.
+    """
+    # Plain string prefixes, computed once per job: cheaper than a
+    # Path.relative_to (and its ValueError) per file.
+    root_prefix = os.path.join(os.fspath(src_root), "") if src_root else None
+    series_prefix = os.path.join(os.fspath(series_src_base), "")
+    plans = []
+    for mkv in mkv_files:
+        mkv_s = os.fspath(mkv)
+        if root_prefix and mkv_s.startswith(root_prefix):
+            root_rel = mkv_s[len(root_prefix) :]
+        else:
+            root_rel = None
+        if mode == "movie":
+            out = MOVIE_DST_BASE / (root_rel or mkv.name)
+        else:
+            if mkv_s.startswith(series_prefix):
+                rel = mkv_s[len(series_prefix) :]
+            elif root_rel:
+                rel = root_rel
+            else:
+                logging.warning(
+                    f"{mkv} not under configured series base {series_src_base}"
+                )
+                continue
+            out = SERIES_DST_BASE / rel
+        plans.append((mkv, out))
+    return plans
+
+
+def skip_existing_outputs(
+    plans: list[tuple[Path, Path]],
+) -> Iterator[tuple[Path, Path]]:
+    """
+    Yields the plans whose output does not exist yet. A destination directory
+    that receives several outputs (a season) is listed once instead of one
+    stat per file; single outputs, e.g. a movie in a large library folder,
+    keep the plain exists() check.
+    """
+    per_parent: dict[Path, int] = {}
+    for _mkv, out in plans:
+        per_parent[out.parent] = per_parent.get(out.parent, 0) + 1
+    listed: dict[Path, set[str]] = {}
+    for mkv, out in plans:
+        if per_parent[out.parent] > 1:
+            names = listed.get(out.parent)
+            if names is None:
+                try:
+                    with os.scandir(out.parent) as it:
+                        names = {entry.name for entry in it}
+                except (FileNotFoundError, NotADirectoryError):
+                    names = set()
+                listed[out.parent] = names
+            exists = out.name in names
+        else:
+            exists = out.exists()
+        if exists:
+            logging.info(f"skip existing file: {out}")
+            continue
+        yield mkv, out
+
+
+class GpuLock:
+    """
+    flock on the shared VAAPI lock file(s). With VAAPI_CONCURRENCY > 1 there
+    is one lock file per hardware session slot (vaapi.lock, vaapi.lock.1, ...)
+    and acquire() takes whichever is free. The files stay open for the whole
+    job; a lock itself is only held while a hardware ffmpeg runs.
+    acquire() and release() are idempotent.
+    """
+
+    def __init__(self, path: Path, slots: int = 1):
+        self.paths = [path] + [
+            path.with_name(f"{path.name}.{slot}") for slot in range(1, slots)
+        ]
+        self.fhs = []
+        self.fh = None
+        self.held = False
+
+    def _try_acquire(self) -> bool:
+        for fh in self.fhs:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            self.fh = fh
+            return True
+        return False
+
+    def acquire(self):
+        if self.held:
+            return
+        if not self.fhs:
+            self.fhs = [open(path, "w") for path in self.paths]
+        if not self._try_acquire():
+            logging.info("waiting for GPU lock…")
+            if len(self.fhs) == 1:
+                self.fh = self.fhs[0]
+                fcntl.flock(self.fh, fcntl.LOCK_EX)
+            else:
+                # flock cannot wait on several files at once; slots free up
+                # at the end of an encode, so polling once a second is enough.
+                while not self._try_acquire():
+                    time.sleep(1.0)
+        self.held = True
+
+    def release(self):
+        if not self.held:
+            return
+        fcntl.flock(self.fh, fcntl.LOCK_UN)
+        self.held = False
+
+    def close(self):
+        try:
+            self.release()
+        finally:
+            for fh in self.fhs:
+                fh.close()
+            self.fhs = []
+            self.fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        self.close()
+        return False
+
+
 def transcode_dir(client, job: dict):
     job_path_raw = job.get("path")
     src_dir = Path(job_path_raw).resolve() if job_path_raw else None
@@ -647,12 +1596,14 @@ def transcode_dir(client, job: dict):
     interlaced = job.get("interlaced")
     source_type = job.get("source_type", "dvd")
     raw_files = job.get("files") or []
-    explicit_files = [Path(p).expanduser().resolve() for p in raw_files]
+    explicit_files = resolve_job_files(raw_files)
     series_src_base = series_src_base_for_source(source_type)
 
     if src_dir and not src_dir.exists():
         logging.warning(f"job path does not exist: {src_dir}")
-        return
+        if not explicit_files:
+            return
+        src_dir = None
 
     src_root = None
     if src_dir:
@@ -682,11 +1633,12 @@ def transcode_dir(client, job: dict):
                 logging.warning("job path is a file but not an MKV: %s", src_dir)
         else:
             mkv_files = []
-            for p in src_dir.rglob("*.mkv"):
-                if is_temp_mkv(p):
-                    logging.info("skip temp mkv from scan: %s", p)
+            for entry in iter_mkv_entries(src_dir):
+                if is_temp_mkv(entry):
+                    logging.info("skip temp mkv from scan: %s", entry.path)
                     continue
-                mkv_files.append(p)
+                mkv_files.append(Path(entry.path))
+            mkv_files.sort()
     else:
         logging.warning("job without path or files, skipping")
         return
@@ -695,239 +1647,201 @@ def transcode_dir(client, job: dict):
         logging.info(f"no MKV files found in {src_dir or 'job list'}")
         return
 
-    did_work = False
-    for mkv in mkv_files:
-        if mode == "movie":
-            rel = None
-            if src_root:
-                try:
-                    rel = mkv.relative_to(src_root)
-                except ValueError:
-                    rel = None
-            if rel is None:
-                rel = mkv.name
-            out = MOVIE_DST_BASE / rel
-        else:
-            try:
-                rel = mkv.relative_to(series_src_base)
-            except ValueError:
-                rel = None
-                if src_root:
-                    try:
-                        rel = mkv.relative_to(src_root)
-                    except ValueError:
-                        rel = None
-                if rel is None:
-                    logging.warning(
-                        f"{mkv} not under configured series base {series_src_base}"
-                    )
-                    continue
-            out = SERIES_DST_BASE / rel
-
-        out.parent.mkdir(parents=True, exist_ok=True)
+    pending = list(
+        skip_existing_outputs(plan_outputs(mkv_files, mode, src_root, series_src_base))
+    )
 
-        if out.exists():
-            logging.info(f"skip existing file: {out}")
-            continue
+    if not pending:
+        logging.info("no transcoding needed – all files already exist")
+        return
 
-        did_work = True
-        logging.info(f"transcoding {mkv} → {out}")
+    for parent in {out.parent for _mkv, out in pending}:
+        parent.mkdir(parents=True, exist_ok=True)
 
-        if interlaced is True:
-            interlaced_effective = True
-        elif interlaced is False:
-            interlaced_effective = False
-        else:
-            interlaced_effective = detect_interlaced(mkv)
+    hw_available = hw_device_available()
+    if not hw_available:
+        logging.warning("skipping hardware encoders for this job")
 
-        video_codec = probe_video_codec(mkv)
-        audio_streams = probe_audio_streams(mkv)
-        subtitle_streams = probe_subtitle_streams(mkv)
-        selected_audio = filter_streams_by_language(audio_streams, AUDIO_LANGS)
-        selected_subs = filter_streams_by_language(subtitle_streams, SUB_LANGS)
+    # Encoder settings only depend on the source type, so they are built once
+    # per job instead of once per file and retry.
+    if source_type == "bluray":
+        qsv_global_quality = QSV_GLOBAL_QUALITY_BLURAY
+        vaapi_qp = VAAPI_QP_BLURAY
+        x265_crf = X265_CRF_BLURAY
+    else:
+        qsv_global_quality = QSV_GLOBAL_QUALITY_DVD
+        vaapi_qp = VAAPI_QP_DVD
+        x265_crf = X265_CRF_DVD
+    qsv_video_args = (
+        "-c:v",
+        "hevc_qsv",
+        "-profile:v",
+        "main",
+        "-global_quality",
+        str(qsv_global_quality),
+        "-pix_fmt",
+        "nv12",
+    )
+    vaapi_video_args = (
+        "-c:v",
+        "hevc_vaapi",
+        "-profile:v",
+        "main10",
+        "-rc_mode",
+        "CQP",
+        "-qp",
+        str(vaapi_qp),
+        "-async_depth",
+        str(VAAPI_ASYNC_DEPTH),
+        *(("-low_power", "1") if vaapi_low_power_supported() else ()),
+    )
+    sw_video_args = (
+        "-c:v",
+        "libx265",
+        "-preset",
+        "slow",
+        "-crf",
+        str(x265_crf),
+        "-pix_fmt",
+        "yuv420p10le",
+        *(("-x265-params", X265_PARAMS) if X265_PARAMS else ()),
+    )
 
-        if audio_streams and not selected_audio:
-            logging.warning(
-                "no audio streams matched language filter %s, keeping all audio",
-                sorted(AUDIO_LANGS),
-            )
-            selected_audio = audio_streams
-
-        audio_mode_effective = AUDIO_MODE
-        if audio_mode_effective == "auto":
-            audio_mode_effective = "encode" if source_type == "bluray" else "copy"
-
-        add_downmix = ENABLE_AAC_DOWNMIX and audio_mode_effective != "copy"
-        if audio_mode_effective == "copy" and ENABLE_AAC_DOWNMIX:
-            logging.warning("AUDIO_MODE=copy disables audio downmix")
-
-        maps = ["-map", "0:v:0"]
-        audio_args: list[str] = []
-        output_audio_index = 0
-        for stream in selected_audio:
-            stream_index = stream.get("index")
-            if stream_index is None:
-                continue
-            maps.extend(["-map", f"0:{stream_index}"])
-            if audio_mode_effective == "copy":
-                continue
-            audio_args.extend(
-                build_audio_args(
-                    output_audio_index, stream.get("channels"), source_type
-                )
+    # The lock file is opened once per job; the GPU lock itself only covers
+    # the hardware ffmpeg runs, probes and publishes happen without it.
+    with (
+        GpuLock(VAAPI_LOCK_PATH, VAAPI_CONCURRENCY) as gpu_lock,
+        DoneReporter(client, MQTT_BATCHED) as done_reporter,
+        ThreadPoolExecutor(max_workers=PREFLIGHT_WORKERS) as prober,
+    ):
+        # The next file is probed while the current one encodes. Without an
+        # interlaced flag from the job, idet for all remaining files runs as
+        # one batch in the background, next to the first file's preflight.
+        probes = prober.submit(probe_source, pending[0][0], interlaced)
+        idet_batch = None
+        if interlaced is None and len(pending) > 2:
+            idet_batch = prober.submit(
+                idet_counts_for, [mkv for mkv, _out in pending[1:]]
             )
-            output_audio_index += 1
-
-        if audio_mode_effective == "copy":
-            audio_args = ["-c:a", "copy"]
-        elif not audio_args and selected_audio:
-            audio_args = [
-                "-c:a",
-                "eac3",
-            ]
 
-        if add_downmix and selected_audio:
-            first_stream = selected_audio[0].get("index")
-            if first_stream is not None:
-                maps.extend(["-map", f"0:{first_stream}"])
-                audio_args.extend(build_downmix_args(output_audio_index))
-                output_audio_index += 1
+        def probe_next(mkv: Path):
+            idet_counts = idet_batch.result().get(mkv) if idet_batch else None
+            return probe_source(mkv, interlaced, idet_counts)
+
+        for index, (mkv, out) in enumerate(pending):
+            mkv_s = os.fspath(mkv)
+            out_s = os.fspath(out)
+            part = partial_output_path(out)
+            part_s = os.fspath(part)
+            logging.info(f"transcoding {mkv_s} → {out_s}")
+
+            (
+                interlaced_effective,
+                video_codec,
+                audio_streams,
+                subtitle_streams,
+                in_duration,
+            ) = probes.result()
+            if index + 1 < len(pending):
+                probes = prober.submit(probe_next, pending[index + 1][0])
+
+            selected_audio = filter_streams_by_language(audio_streams, AUDIO_LANGS)
+            selected_subs = filter_streams_by_language(subtitle_streams, SUB_LANGS)
+
+            if audio_streams and not selected_audio:
+                logging.warning(
+                    "no audio streams matched language filter %s, keeping all audio",
+                    sorted(AUDIO_LANGS),
+                )
+                selected_audio = audio_streams
 
-        for stream in selected_subs:
-            stream_index = stream.get("index")
-            if stream_index is None:
-                continue
-            maps.extend(["-map", f"0:{stream_index}"])
+            audio_mode_effective = AUDIO_MODE
+            if audio_mode_effective == "auto":
+                audio_mode_effective = "encode" if source_type == "bluray" else "copy"
 
-        qsv_global_quality = (
-            QSV_GLOBAL_QUALITY_BLURAY
-            if source_type == "bluray"
-            else QSV_GLOBAL_QUALITY_DVD
-        )
-        vaapi_qp = VAAPI_QP_BLURAY if source_type == "bluray" else VAAPI_QP_DVD
-        x265_crf = X265_CRF_BLURAY if source_type == "bluray" else X265_CRF_DVD
+            add_downmix = ENABLE_AAC_DOWNMIX and audio_mode_effective != "copy"
+            if audio_mode_effective == "copy" and ENABLE_AAC_DOWNMIX:
+                logging.warning("AUDIO_MODE=copy disables audio downmix")
 
-        def build_qsv_cmd() -> list[str]:
-            cmd = [
-                FFMPEG_BIN,
+            mapped_audio = [s for s in selected_audio if s.get("index") is not None]
+            sub_indices = [
+                s["index"] for s in selected_subs if s.get("index") is not None
             ]
-            if QSV_DIRECT:
-                cmd.extend(
-                    [
-                        "-hwaccel",
-                        "qsv",
-                        "-qsv_device",
-                        "/dev/dri/renderD128",
-                        "-hwaccel_output_format",
-                        "qsv",
-                    ]
-                )
-            else:
-                cmd.extend(
-                    [
-                        "-init_hw_device",
-                        "vaapi=va:/dev/dri/renderD128",
-                        "-init_hw_device",
-                        "qsv=qsv@va",
-                        "-filter_hw_device",
-                        "qsv",
-                    ]
-                )
-            cmd.extend(
-                [
-                    "-i",
-                    str(mkv),
+            maps = ["-map", "0:v:0"]
+            maps += [tok for s in mapped_audio for tok in ("-map", f"0:{s['index']}")]
+
+            audio_args: list[str] = []
+            output_audio_index = 0
+            if audio_mode_effective == "copy":
+                audio_args = ["-c:a", "copy"]
+            elif mapped_audio:
+                audio_args = [
+                    arg
+                    for i, stream in enumerate(mapped_audio)
+                    for arg in build_audio_args(i, stream.get("channels"), source_type)
                 ]
-            )
-            vf = build_qsv_filter(interlaced_effective, QSV_DIRECT)
-            if vf:
-                cmd.extend(["-vf", vf])
-            cmd.extend(maps)
-            cmd.extend(
-                [
-                    "-c:v",
-                    "hevc_qsv",
-                    "-profile:v",
-                    "main",
-                    "-global_quality",
-                    str(qsv_global_quality),
-                    "-pix_fmt",
-                    "nv12",
+                output_audio_index = len(mapped_audio)
+            elif selected_audio:
+                audio_args = [
+                    "-c:a",
+                    "eac3",
                 ]
-            )
-            cmd.extend(audio_args)
-            if add_downmix:
-                cmd.extend(build_downmix_args())
-            cmd.extend(["-c:s", "copy", str(out)])
-            return cmd
-
-        def build_vaapi_cmd() -> list[str]:
-            cmd = [
-                FFMPEG_BIN,
-                "-init_hw_device",
-                "vaapi=va:/dev/dri/renderD128",
-                "-filter_hw_device",
-                "va",
-                "-i",
-                str(mkv),
-            ]
-            vf = build_video_filter(interlaced_effective, hwupload=True)
-            if vf:
-                cmd.extend(["-vf", vf])
-            cmd.extend(maps)
-            cmd.extend(
-                [
-                    "-c:v",
-                    "hevc_vaapi",
-                    "-profile:v",
-                    "main10",
-                    "-qp",
-                    str(vaapi_qp),
-                ]
-            )
-            cmd.extend(audio_args)
-            if add_downmix:
-                cmd.extend(build_downmix_args())
-            cmd.extend(["-c:s", "copy", str(out)])
-            return cmd
-
-        def build_sw_cmd() -> list[str]:
-            cmd = [
-                FFMPEG_BIN,
-                "-i",
-                str(mkv),
-            ]
-            vf = build_sw_filter(interlaced_effective)
-            if vf:
-                cmd.extend(["-vf", vf])
-            cmd.extend(maps)
-            cmd.extend(
-                [
-                    "-c:v",
-                    "libx265",
-                    "-preset",
-                    "slow",
-                    "-crf",
-                    str(x265_crf),
-                    "-pix_fmt",
-                    "yuv420p10le",
+
+            if add_downmix and selected_audio:
+                first_stream = selected_audio[0].get("index")
+                if first_stream is not None:
+                    maps += ["-map", f"0:{first_stream}"]
+                    audio_args.extend(build_downmix_args(output_audio_index))
+                    output_audio_index += 1
+
+            maps += [tok for i in sub_indices for tok in ("-map", f"0:{i}")]
+
+            def build_cmd(input_args, vf: str | None, video_args) -> list[str]:
+                return [
+                    FFMPEG_BIN,
+                    *ENCODE_GLOBAL_ARGS,
+                    *input_args,
+                    "-i",
+                    mkv_s,
+                    *(("-vf", vf) if vf else ()),
+                    *maps,
+                    *video_args,
+                    *audio_args,
+                    "-c:s",
+                    "copy",
+                    part_s,
                 ]
-            )
-            cmd.extend(audio_args)
-            if add_downmix:
-                cmd.extend(build_downmix_args())
-            cmd.extend(["-c:s", "copy", str(out)])
-            return cmd
 
-        try:
-            hw_failed = False
+            def build_qsv_cmd() -> list[str]:
+                vf = build_qsv_filter(interlaced_effective, QSV_DIRECT)
+                return build_cmd(QSV_INPUT_ARGS, vf, qsv_video_args)
+
+            def build_vaapi_cmd() -> list[str]:
+                vf = build_video_filter(interlaced_effective, hwupload=True)
+                return build_cmd(VAAPI_INPUT_ARGS, vf, vaapi_video_args)
 
-            with open("/var/lock/vaapi.lock", "w") as lock:
-                logging.info("waiting for GPU lock…")
-                fcntl.flock(lock, fcntl.LOCK_EX)
+            def build_sw_cmd() -> list[str]:
+                vf = build_sw_filter(interlaced_effective)
+                return build_cmd((), vf, sw_video_args)
+
+            part_fd = lock_partial_output(part)
+            if part_fd is None:
+                logging.info("skip %s: another encode is writing %s", mkv_s, part_s)
+                continue
+            renamed = False
+            try:
+                if out.exists():
+                    # Finished by another worker after this job was planned.
+                    logging.info("skip %s: %s already exists", mkv_s, out_s)
+                    part.unlink(missing_ok=True)
+                    continue
+
+                hw_failed = True
 
                 max_hw_retries = MAX_HW_RETRIES
-                if video_codec == "vc1":
+                if not hw_available:
+                    encoders = []
+                elif video_codec == "vc1":
                     logging.info("vc1 source detected, skipping qsv decode")
                     encoders = [
                         ("vaapi", build_vaapi_cmd),
@@ -938,6 +1852,8 @@ def transcode_dir(client, job: dict):
                         ("vaapi", build_vaapi_cmd),
                     ]
 
+                if encoders:
+                    gpu_lock.acquire()
                 for encoder_label, cmd_builder in encoders:
                     for attempt in range(0, max_hw_retries + 1):
                         cmd = cmd_builder()
@@ -950,30 +1866,20 @@ def transcode_dir(client, job: dict):
                             mqtt_publish(
                                 client,
                                 MQTT_TOPIC_START,
-                                {
-                                    "version": MQTT_PAYLOAD_VERSION,
-                                    "file": str(mkv),
-                                    "output": str(out),
-                                    "encoder": encoder_label,
-                                    "ts": int(time.time()),
-                                },
+                                status_payload(
+                                    file=mkv_s,
+                                    output=out_s,
+                                    encoder=encoder_label,
+                                ),
+                                qos=MQTT_STATUS_QOS,
                             )
                         logging.info("running ffmpeg with encoder %s", encoder_label)
                         logging.info("ffmpeg cmd: %s", " ".join(cmd))
                         try:
-                            subprocess.run(cmd, check=True)
+                            run_ffmpeg(cmd, in_duration)
                             hw_failed = False
                             break
                         except (CalledProcessError, FileNotFoundError) as e:
-                            if out.exists():
-                                try:
-                                    out.unlink()
-                                except OSError as cleanup_err:
-                                    logging.warning(
-                                        "could not remove incomplete output %s: %s",
-                                        out,
-                                        cleanup_err,
-                                    )
                             if attempt >= max_hw_retries:
                                 logging.warning(
                                     "ffmpeg %s failed (%s) for %s -> %s; trying next encoder",
@@ -991,119 +1897,154 @@ def transcode_dir(client, job: dict):
                                     out,
                                 )
                                 continue
-                    if out.exists():
-                        hw_failed = False
+                    if not hw_failed:
                         break
-                    hw_failed = True
+                gpu_lock.release()
+
+                if hw_failed:
+                    if not ENABLE_SW_FALLBACK:
+                        logging.error(
+                            "hardware transcode failed after retries (SW fallback disabled) for %s",
+                            mkv,
+                        )
+                        mqtt_publish(
+                            client,
+                            MQTT_TOPIC_ERROR,
+                            status_payload(
+                                file=mkv_s,
+                                error="hardware transcode failed (SW fallback disabled)",
+                            ),
+                        )
+                        part.unlink(missing_ok=True)
+                        continue
 
-            if hw_failed:
-                if not ENABLE_SW_FALLBACK:
-                    logging.error(
-                        "hardware transcode failed after retries (SW fallback disabled) for %s",
-                        mkv,
-                    )
                     mqtt_publish(
                         client,
-                        MQTT_TOPIC_ERROR,
-                        {
-                            "version": MQTT_PAYLOAD_VERSION,
-                            "file": str(mkv),
-                            "error": "hardware transcode failed (SW fallback disabled)",
-                            "ts": int(time.time()),
-                        },
+                        MQTT_TOPIC_START,
+                        status_payload(
+                            file=mkv_s,
+                            output=out_s,
+                            encoder="software",
+                        ),
+                        qos=MQTT_STATUS_QOS,
                     )
-                    continue
+                    sw_cmd = build_sw_cmd()
+                    run_ffmpeg(sw_cmd, in_duration)
+
+                # Only a finished encode gets the real name, so out.exists()
+                # keeps meaning "done" even after a crash mid-encode.
+                os.replace(part_s, out_s)
+                renamed = True
+
+                # Without an input duration there is nothing to compare with,
+                # so the output is not probed at all.
+                if VERIFY_OUTPUT_DURATION and in_duration:
+                    out_duration = probe_duration(out)
+                else:
+                    out_duration = None
+                if in_duration and out_duration:
+                    tolerance = max(1.0, in_duration * 0.01)  # 1s or 1% of input
+                    if abs(in_duration - out_duration) > tolerance:
+                        logging.warning(
+                            "duration mismatch (in=%0.2fs, out=%0.2fs, tol=%0.2fs) for %s (keeping output)",
+                            in_duration,
+                            out_duration,
+                            tolerance,
+                            mkv,
+                        )
 
-                if out.exists():
+                drop_page_cache(mkv_s)
+                done_reporter.done(out_s)
+
+            except Exception as e:
+                mqtt_publish(
+                    client,
+                    MQTT_TOPIC_ERROR,
+                    status_payload(file=mkv_s, error=str(e)),
+                )
+                # Still under the flock, so this is our half-written encode;
+                # after the rename the name may belong to another writer.
+                if not renamed:
                     try:
-                        out.unlink()
+                        part.unlink(missing_ok=True)
                     except OSError as cleanup_err:
                         logging.warning(
                             "could not remove failed output %s: %s",
-                            out,
+                            part,
                             cleanup_err,
                         )
-
-                mqtt_publish(
-                    client,
-                    MQTT_TOPIC_START,
-                    {
-                        "version": MQTT_PAYLOAD_VERSION,
-                        "file": str(mkv),
-                        "output": str(out),
-                        "encoder": "software",
-                        "ts": int(time.time()),
-                    },
-                )
-                sw_cmd = build_sw_cmd()
-                subprocess.run(sw_cmd, check=True)
-
-            in_duration = probe_duration(mkv)
-            out_duration = probe_duration(out)
-            if in_duration and out_duration:
-                tolerance = max(1.0, in_duration * 0.01)  # 1s or 1% of input
-                if abs(in_duration - out_duration) > tolerance:
-                    logging.warning(
-                        "duration mismatch (in=%0.2fs, out=%0.2fs, tol=%0.2fs) for %s (keeping output)",
-                        in_duration,
-                        out_duration,
-                        tolerance,
-                        mkv,
-                    )
-
-            mqtt_publish(
-                client,
-                MQTT_TOPIC_DONE,
-                {
-                    "version": MQTT_PAYLOAD_VERSION,
-                    "file": str(out),
-                    "ts": int(time.time()),
-                },
-            )
-
-        except Exception as e:
-            mqtt_publish(
-                client,
-                MQTT_TOPIC_ERROR,
-                {
-                    "version": MQTT_PAYLOAD_VERSION,
-                    "file": str(mkv),
-                    "error": str(e),
-                    "ts": int(time.time()),
-                },
-            )
-            raise
-
-    if not did_work:
-        logging.info("no transcoding needed – all files already exist")
+                raise
+            finally:
+                os.close(part_fd)
 
 
 # --------------------
 # Worker Thread
 # --------------------
-def worker_loop(client: mqtt.Client, job_queue):
+def worker_loop(client: mqtt.Client, job_queue, batch_size: int):
     while True:
-        job = job_queue.get()
-        try:
-            if isinstance(job, Path):
-                job = {"path": str(job.resolve()), "mode": "series"}
-            logging.info(f"processing queued job for {job.get('path')}")
+        if isinstance(job_queue, SQLiteJobQueue):
+            jobs = job_queue.get_batch(batch_size)
+        else:
+            jobs = [job_queue.get()]
+        for index, job in enumerate(jobs):
+            if (
+                index > 0
+                and isinstance(job_queue, SQLiteJobQueue)
+                and not job_queue.renew_claim(job)
+            ):
+                logging.warning(
+                    "claim for queued job %s expired, leaving it to its new owner",
+                    job.get("path"),
+                )
+                continue
+            process_job(client, job_queue, job)
+
+
+def process_job(client: mqtt.Client, job_queue, job):
+    try:
+        if isinstance(job, Path):
+            job = {"path": str(job.resolve()), "mode": "series"}
+        logging.info(f"processing queued job for {job.get('path')}")
+        if isinstance(job_queue, SQLiteJobQueue):
+            with ClaimRenewer(job_queue, job):
+                transcode_dir(client, job)
+        else:
             transcode_dir(client, job)
-        except Exception:
-            logging.exception(f"transcode error while handling {job.get('path')}")
-        finally:
-            if isinstance(job_queue, SQLiteJobQueue):
-                job_queue.task_done(job)
-            else:
-                job_queue.task_done()
+    except Exception:
+        logging.exception(f"transcode error while handling {job.get('path')}")
+    finally:
+        if isinstance(job_queue, SQLiteJobQueue):
+            job_queue.task_done(job)
+        else:
+            job_queue.task_done()
 
 
 # --------------------
-# MQTT callback
+# MQTT callbacks
 # --------------------
+def on_connect(client, userdata, flags, reason_code, properties=None):
+    if getattr(reason_code, "is_failure", reason_code != 0):
+        logging.warning(f"MQTT connect refused: {reason_code}")
+        return
+    if isinstance(flags, dict):
+        session_present = bool(flags.get("session present"))
+    else:
+        session_present = bool(getattr(flags, "session_present", False))
+    # Subscribing again on a resumed session is a no-op for the broker, but
+    # picks up a changed MQTT_TOPIC that the stored session does not have.
+    logging.info(
+        "MQTT connected (%s session %s), subscribing to %s",
+        "resumed" if session_present else "new",
+        MQTT_CLIENT_ID,
+        MQTT_TOPIC,
+    )
+    client.subscribe(MQTT_TOPIC, qos=1)
+
+
 def on_message(client, userdata, msg):
     try:
-        payload = json.loads(msg.payload.decode())
+        payload = decode_payload(msg.payload)
 
         version = payload.get("version")
         if not isinstance(version, int):
@@ -1113,13 +2054,6 @@ def on_message(client, userdata, msg):
                 MQTT_PAYLOAD_VERSION,
             )
             return
-        if version < MQTT_PAYLOAD_VERSION:
-            logging.warning(
-                "unsupported payload version %s, expected %s",
-                version,
-                MQTT_PAYLOAD_VERSION,
-            )
-            return
         if version != MQTT_PAYLOAD_VERSION:
             logging.warning(
                 "unsupported payload version %s, expected %s",
@@ -1128,23 +2062,21 @@ def on_message(client, userdata, msg):
             )
             return
 
+        # Runs on the paho network thread: only normalize paths here, the
+        # worker resolves them and checks that they exist.
         path = None
-        if "path" in payload:
-            path = Path(payload["path"]).expanduser().resolve()
-            if not path.exists():
-                logging.warning(f"received path does not exist: {path}")
-                path = None
+        if payload.get("path"):
+            path = Path(os.path.abspath(os.path.expanduser(payload["path"])))
 
         files_raw = payload.get("files")
         files = []
         if isinstance(files_raw, list) and files_raw:
             files = [
-                str(Path(file_path).expanduser().resolve()) for file_path in files_raw
+                os.path.abspath(os.path.expanduser(file_path))
+                for file_path in files_raw
             ]
         elif path is None:
-            logging.warning(
-                "payload requires 'files' list or existing 'path', skipping"
-            )
+            logging.warning("payload requires 'files' list or 'path', skipping")
             return
 
         mode = payload.get("mode")
@@ -1190,7 +2122,7 @@ def on_message(client, userdata, msg):
             }
         )
 
-    except json.JSONDecodeError:
+    except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses it
         logging.warning("invalid JSON payload received")
 
     except Exception:
@@ -1201,6 +2133,7 @@ def on_message(client, userdata, msg):
 # Main
 # --------------------
 def main():
+    global PROBE_STORE
     logging.info("transcode-mqtt starting up")
     logging.info(
         "config: SRC_BASE=%s (series subpath=%s, movie subpath=%s), SERIES_DST_BASE=%s, "
@@ -1221,27 +2154,57 @@ def main():
             poll_interval=JOB_QUEUE_POLL_INTERVAL,
             claim_ttl_seconds=JOB_QUEUE_CLAIM_TTL,
         )
+        PROBE_STORE = job_queue
         logging.info(
-            "using SQLite queue at %s (poll_interval=%ss, claim_ttl=%ss)",
+            "using SQLite queue at %s (poll_interval=%ss, claim_ttl=%ss, batch=%s)",
             JOB_QUEUE_SQLITE_PATH,
             JOB_QUEUE_POLL_INTERVAL,
             JOB_QUEUE_CLAIM_TTL,
+            JOB_QUEUE_BATCH_SIZE,
         )
     else:
         job_queue = queue.Queue()
         logging.info("using in-memory queue backend")
     client.user_data_set(job_queue)
+    client.on_connect = on_connect
     client.on_message = on_message
 
-    worker = threading.Thread(target=worker_loop, args=(client, job_queue), daemon=True)
-    worker.start()
+    # With several workers each claims one job at a time, so a single worker
+    # cannot hold a whole batch while the others sit idle.
+    batch_size = JOB_QUEUE_BATCH_SIZE if WORKER_THREADS == 1 else 1
+    worker_exited = threading.Event()
+    dead_workers: list[str] = []
+
+    def run_worker():
+        try:
+            worker_loop(client, job_queue, batch_size)
+        finally:
+            dead_workers.append(threading.current_thread().name)
+            worker_exited.set()
 
-    connect_mqtt(client)
+    workers = [
+        threading.Thread(target=run_worker, name=f"worker-{index}", daemon=True)
+        for index in range(WORKER_THREADS)
+    ]
+    for worker in workers:
+        worker.start()
 
-    client.subscribe(MQTT_TOPIC, qos=1)
+    logging.info("connecting to MQTT broker…")
+    client.connect_async(MQTT_HOST, MQTT_PORT, 60)
     logging.info("waiting for rip events…")
 
-    client.loop_forever()
+    # Run the network loop in paho's own thread: status publishes from the
+    # worker are only queued there instead of being written to the socket
+    # inline between ffmpeg runs. The thread also retries the first connect
+    # and reconnects with the backoff from build_mqtt_client.
+    client.loop_start()
+
+    # worker_loop only returns by raising. Any dead worker stops the service
+    # so it gets restarted, instead of running on with fewer workers.
+    worker_exited.wait()
+    logging.error("worker thread(s) %s died, shutting down", ", ".join(dead_workers))
+    client.loop_stop()
+    sys.exit(1)
 
 
 if __name__ == "__main__":